@@ -1,36 +1,221 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import JSONResponse
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form, Header, Query
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Callable, Iterator, List, Optional, Union
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import fitz  # PyMuPDF
 import asyncio
 import aiofiles
 import json
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+import hnswlib
 import re
 import tempfile
 import shutil
+import hashlib
+import base64
+import threading
+import itertools
+import bisect
+import cProfile
+import pstats
+import hmac
+import socket
+import fcntl
+import random
+from collections import Counter, OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter as MetricCounter, Gauge, Histogram, generate_latest,
+    multiprocess
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Tokenizers are also used in forked extraction workers
+os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-# Initialize the embedding model
-model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+# Embedding model settings
+EMBEDDING_MODEL_NAME = os.environ.get('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'torch')  # torch, torch-int8 or onnx-int8
+ONNX_MODEL_DIR = Path(os.environ.get('ONNX_MODEL_DIR', str(ROOT_DIR / 'onnx_models')))
+# When to load the model: 'startup' loads it in the background once the app
+# starts, 'lazy' on the first request that needs it, and 'import' while this
+# module is imported, so that `gunicorn --preload -k uvicorn.workers.UvicornWorker
+# server:app` forks workers that share the weights copy-on-write
+MODEL_PRELOAD = os.environ.get('MODEL_PRELOAD', 'startup')
+
+# Reranking settings
+# With RERANK_TOP_N > 0 the RERANK_TOP_N best chunks of the first stage are
+# rescored by a cross-encoder, as far as RERANK_BUDGET_MS allows
+RERANK_MODEL_NAME = os.environ.get('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANK_TOP_N = int(os.environ.get('RERANK_TOP_N', '0'))
+RERANK_BATCH_SIZE = int(os.environ.get('RERANK_BATCH_SIZE', '16'))
+RERANK_BUDGET_MS = int(os.environ.get('RERANK_BUDGET_MS', '1500'))
+
+# Pipeline settings
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', '100'))
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '32'))
+# Chunks are budgeted in characters, or with CHUNK_MODE=tokens in model tokens;
+# all-MiniLM-L6-v2 truncates at 256 tokens including [CLS] and [SEP]
+CHUNK_MODE = os.environ.get('CHUNK_MODE', 'chars')
+CHUNK_MAX_LENGTH = int(os.environ.get('CHUNK_MAX_LENGTH', '500'))
+CHUNK_MAX_TOKENS = int(os.environ.get('CHUNK_MAX_TOKENS', '254'))
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', '0'))  # Sentences shared by consecutive chunks
+MIN_CHUNK_LENGTH = 50
+# Chunks repeating earlier ones reuse their embeddings: 'exact' matches
+# identical text, 'near' also texts whose word pairs have an estimated
+# Jaccard similarity of at least NEAR_DUPLICATE_JACCARD, and 'off' embeds
+# every chunk
+DEDUP_MODE = os.environ.get('DEDUP_MODE', 'exact')
+NEAR_DUPLICATE_JACCARD = float(os.environ.get('NEAR_DUPLICATE_JACCARD', '0.75'))  # Calibrated on prose chunks
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 32  # LSH bands of 4 rows: pairs at the threshold share one with near certainty
+# 'text' chunks plain page text; 'layout' splits documents into sections at
+# headings detected from font size and weight, and chunks within sections
+EXTRACTION_MODE = os.environ.get('EXTRACTION_MODE', 'text')
+HEADING_SIZE_RATIO = float(os.environ.get('HEADING_SIZE_RATIO', '1.15'))
+MAX_HEADING_LENGTH = 120
+DEFAULT_TOP_K = 10
+MAX_TOP_K = 100
+# History listings are paginated newest first
+DEFAULT_PAGE_SIZE = 20
+MAX_ANALYSES_PAGE_SIZE = 100
+MAX_STATUS_PAGE_SIZE = 1000
+# 'dense' ranks chunks by embedding similarity alone; 'rrf' and 'weighted'
+# fuse it with BM25 by reciprocal rank or by a blend of min-max normalized
+# scores, where FUSION_WEIGHT is the share of the embedding score
+RANKING_MODE = os.environ.get('RANKING_MODE', 'dense')
+FUSION_WEIGHT = float(os.environ.get('FUSION_WEIGHT', '0.7'))
+RRF_K = 60
+# Diversification: MMR_LAMBDA < 1 re-selects results from the best
+# MMR_CANDIDATES chunks by maximal marginal relevance, trading relevance for
+# novelty; MAX_SECTIONS_PER_DOCUMENT > 0 caps the results taken from one file
+MMR_LAMBDA = float(os.environ.get('MMR_LAMBDA', '1.0'))
+MMR_CANDIDATES = int(os.environ.get('MMR_CANDIDATES', '200'))
+MAX_SECTIONS_PER_DOCUMENT = int(os.environ.get('MAX_SECTIONS_PER_DOCUMENT', '0'))
+# 'lead' summarizes a section by its first sentences; 'query' picks the
+# sentences closest to the persona/job query, diversified with MMR
+SUMMARY_MODE = os.environ.get('SUMMARY_MODE', 'lead')
+SUMMARY_MAX_LENGTH = 200
+SUMMARY_MMR_LAMBDA = float(os.environ.get('SUMMARY_MMR_LAMBDA', '0.7'))
+BM25_K1 = 1.2
+BM25_B = 0.75
+# With BM25_PREFILTER > 0 only the BM25_PREFILTER chunks of uncached uploads
+# that BM25 ranks highest for the query are embedded
+BM25_PREFILTER = int(os.environ.get('BM25_PREFILTER', '0'))
+
+# PDFs with at least PARALLEL_EXTRACT_MIN_PAGES pages are split into ranges of
+# PAGES_PER_TASK pages that are extracted in parallel; chunks are embedded as
+# soon as EMBED_FLUSH_CHUNKS of them are ready
+PARALLEL_EXTRACT_MIN_PAGES = int(os.environ.get('PARALLEL_EXTRACT_MIN_PAGES', '64'))
+PAGES_PER_TASK = int(os.environ.get('PAGES_PER_TASK', '32'))
+EMBED_FLUSH_CHUNKS = int(os.environ.get('EMBED_FLUSH_CHUNKS', '512'))
+# Progress is reported per extracted page range; when it is requested, text
+# mode extracts ranges of at most PROGRESS_PAGES_PER_TASK pages so that small
+# files report progress too. Layout mode keeps its ranges, as sections never
+# span two ranges
+PROGRESS_PAGES_PER_TASK = int(os.environ.get('PROGRESS_PAGES_PER_TASK', '8'))
+
+# Uploads up to INMEMORY_PDF_MAX_BYTES are parsed from memory; larger ones are
+# spooled to a temporary file and opened by path, as are in-memory ones split
+# into several page ranges, which would otherwise be copied to every task
+INMEMORY_PDF_MAX_BYTES = int(os.environ.get('INMEMORY_PDF_MAX_BYTES', str(32 * 1024 ** 2)))
+UPLOAD_READ_BLOCK_BYTES = 1024 ** 2
+
+# Embedding cache settings
+EMBEDDING_CACHE_DIR = Path(os.environ.get('EMBEDDING_CACHE_DIR', str(ROOT_DIR / 'embedding_cache')))
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get('EMBEDDING_CACHE_MAX_BYTES', str(1024 ** 3)))
+
+# Result cache settings
+# Identical analyses within RESULT_CACHE_TTL seconds return the stored result;
+# RESULT_CACHE_SIZE recent results are also kept in memory
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', '3600'))
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '256'))
+
+# Query embedding cache settings
+# Embeddings of QUERY_CACHE_SIZE recent persona/job queries are kept in memory
+# and, with QUERY_CACHE_PERSIST=true, in the query_embeddings collection; at
+# startup the cache is warmed with the queries of the QUERY_CACHE_WARM most
+# recent analyses
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_PERSIST = os.environ.get('QUERY_CACHE_PERSIST', 'false').lower() == 'true'
+QUERY_CACHE_WARM = int(os.environ.get('QUERY_CACHE_WARM', '200'))
+
+# Corpus index settings
+CORPUS_DIR = Path(os.environ.get('CORPUS_DIR', str(ROOT_DIR / 'corpus')))
+CORPUS_INDEX_M = int(os.environ.get('CORPUS_INDEX_M', '16'))
+CORPUS_INDEX_EF_CONSTRUCTION = int(os.environ.get('CORPUS_INDEX_EF_CONSTRUCTION', '200'))
+CORPUS_INDEX_EF_SEARCH = int(os.environ.get('CORPUS_INDEX_EF_SEARCH', '64'))
+
+# Job queue settings
+JOBS_DIR = Path(os.environ.get('JOBS_DIR', str(ROOT_DIR / 'jobs')))
+# Job uploads are stored under JOBS_DIR, so a job only runs on the host that
+# created it; hosts sharing JOBS_DIR can set the same JOB_HOST to share jobs
+JOB_HOST = os.environ.get('JOB_HOST', socket.gethostname())
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', '100'))
+# Jobs whose uploads exceed HEAVY_JOB_BYTES default to low priority
+HEAVY_JOB_BYTES = int(os.environ.get('HEAVY_JOB_BYTES', str(20 * 1024 ** 2)))
+JOB_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+# Running jobs record the worker process running them, which refreshes their
+# heartbeat every JOB_HEARTBEAT_SECONDS; jobs whose heartbeat is older than
+# JOB_STALE_SECONDS are requeued, as their worker is gone
+JOB_HEARTBEAT_SECONDS = int(os.environ.get('JOB_HEARTBEAT_SECONDS', '15'))
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', '60'))
+
+# Metrics settings
+# With SERVER_TIMING=true responses carry a Server-Timing header with the
+# seconds each stage took; stages run in parallel report their summed time
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+# Metrics are kept per process. With several workers, set PROMETHEUS_MULTIPROC_DIR
+# in the server's environment (it is read when prometheus_client is imported)
+# to an empty directory shared by the workers, so that /api/metrics reports
+# their sum; gunicorn's child_exit hook should call
+# prometheus_client.multiprocess.mark_process_dead(worker.pid)
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# Profiling settings
+# Analyses are profiled with cProfile when the request carries an X-Profile
+# header equal to PROFILE_ADMIN_TOKEN, or at random for PROFILE_SAMPLE_RATE
+# of them; the PROFILE_MAX_FILES most recent profiles are kept
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles')))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '50'))
+PROFILE_NAME_PATTERN = re.compile(r'[\w.-]+\.prof')
+
+# Worker pool settings
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', str(min(4, os.cpu_count() or 1))))
+EMBED_WORKERS = int(os.environ.get('EMBED_WORKERS', '1'))
+# Each pool runs at most MAX_PENDING_* tasks at once, and further tasks wait
+# their turn; MAX_CONCURRENT_ANALYSES bounds the requests being processed,
+# and requests beyond it are refused with 503
+MAX_PENDING_EXTRACT = int(os.environ.get('MAX_PENDING_EXTRACT', '64'))
+MAX_PENDING_EMBED = int(os.environ.get('MAX_PENDING_EMBED', '8'))
+MAX_CONCURRENT_ANALYSES = int(os.environ.get('MAX_CONCURRENT_ANALYSES', '8'))
+RETRY_AFTER_SECONDS = int(os.environ.get('RETRY_AFTER_SECONDS', '5'))
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -53,6 +238,10 @@ class DocumentSection(BaseModel):
     score: float
     text: str
     summary: str
+    filename: Optional[str] = None
+    title: Optional[str] = None
+    page_end: Optional[int] = None
+    stage: Optional[str] = None  # 'retrieval' or 'rerank', whichever produced the score
 
 class DocumentAnalysisResult(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -65,52 +254,985 @@ class DocumentAnalysisRequest(BaseModel):
     persona: str
     job: str
 
+class AnalysisJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    persona: str
+    job: str
+    top_k: int = DEFAULT_TOP_K
+    priority: str = "normal"
+    status: str = "queued"  # queued, running, completed, failed or cancelled
+    filenames: List[str] = []
+    error: Optional[str] = None
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class CorpusDocument(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    filename: str
+    sha256: str
+    chunks: int
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+class CorpusQuery(BaseModel):
+    persona: str
+    job: str
+    top_k: int = Field(default=DEFAULT_TOP_K, ge=1, le=MAX_TOP_K)
+
+# Embedding backends
+class TorchEmbedder:
+    """SentenceTransformer inference in PyTorch, optionally with int8 dynamic quantization"""
+    
+    def __init__(self, model_name: str, quantize: bool = False):
+        from sentence_transformers import SentenceTransformer
+        
+        self.model = SentenceTransformer(model_name, device='cpu')
+        if quantize:
+            import torch
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.tokenizer = self.model.tokenizer
+        self.dim = self.model.get_sentence_embedding_dimension()
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized float32 embeddings of one batch of texts"""
+        import torch
+        
+        # SentenceTransformer.encode for one batch, keeping the attention mask
+        features = self.model.tokenize(texts)
+        TOKENS_EMBEDDED.inc(int(features['attention_mask'].sum()))
+        with torch.inference_mode():
+            embeddings = self.model(features)['sentence_embedding']
+        return torch.nn.functional.normalize(embeddings, p=2, dim=1).numpy()
+
+class OnnxEmbedder:
+    """ONNX Runtime inference of the transformer, exported once and quantized to int8
+
+    Mean pooling and normalization are done in numpy, which matches
+    all-MiniLM-L6-v2 and other mean-pooled sentence-transformers models.
+    """
+    
+    def __init__(self, model_name: str, export_dir: Path):
+        import onnxruntime
+        from sentence_transformers import SentenceTransformer
+        
+        st_model = SentenceTransformer(model_name, device='cpu')
+        if st_model[1].get_pooling_mode_str() != 'mean':
+            raise ValueError(f"{model_name} does not use mean pooling")
+        self.tokenizer = st_model.tokenizer
+        self.max_seq_length = st_model.max_seq_length
+        self.dim = st_model.get_sentence_embedding_dimension()
+        
+        onnx_path = export_dir / f"{model_name.replace('/', '__')}-int8.onnx"
+        if not onnx_path.exists():
+            self._export(st_model, onnx_path)
+        
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(str(onnx_path), options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+    
+    @staticmethod
+    def _export(st_model, onnx_path: Path):
+        import torch
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        
+        onnx_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(onnx_path.with_suffix('.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file is closed
+            if onnx_path.exists():
+                return  # Another process exported the model while we waited
+            
+            features = st_model.tokenize(["Export sample text"])
+            input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in features]
+            dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']}
+            
+            # The export goes to a private directory next to the model, as the
+            # exporter may write the weights to extra files, and the quantized
+            # model is published by atomically renaming it
+            tmp_dir = Path(tempfile.mkdtemp(dir=onnx_path.parent))
+            try:
+                float_path = tmp_dir / 'model.fp32.onnx'
+                quantized_path = tmp_dir / 'model.int8.onnx'
+                torch.onnx.export(
+                    st_model[0].auto_model,
+                    tuple(features[name] for name in input_names),
+                    str(float_path),
+                    input_names=input_names,
+                    output_names=['last_hidden_state'],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=14
+                )
+                quantize_dynamic(str(float_path), str(quantized_path), weight_type=QuantType.QInt8)
+                os.replace(quantized_path, onnx_path)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized float32 embeddings of one batch of texts"""
+        features = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors='np'
+        )
+        TOKENS_EMBEDDED.inc(int(features['attention_mask'].sum()))
+        hidden = self.session.run(None, {name: features[name].astype(np.int64) for name in self.input_names})[0]
+        
+        mask = features['attention_mask'][..., None].astype(np.float32)
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+def load_embedder(backend: str):
+    """Create the embedding backend selected by name"""
+    if backend == 'torch':
+        return TorchEmbedder(EMBEDDING_MODEL_NAME)
+    if backend == 'torch-int8':
+        return TorchEmbedder(EMBEDDING_MODEL_NAME, quantize=True)
+    if backend == 'onnx-int8':
+        return OnnxEmbedder(EMBEDDING_MODEL_NAME, ONNX_MODEL_DIR)
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+# The embedding model is shared by all requests and loaded once, on first use
+_embedder = None
+_embedder_lock = threading.Lock()
+model_load_seconds = None
+model_load_error = None  # Why loading the models in the background failed
+
+def get_embedder():
+    """Return the embedding backend, loading it if needed"""
+    global _embedder, model_load_seconds
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                started = time.perf_counter()
+                embedder = load_embedder(EMBEDDING_BACKEND)
+                model_load_seconds = time.perf_counter() - started
+                logging.info(f"Loaded {EMBEDDING_MODEL_NAME} ({EMBEDDING_BACKEND}) in {model_load_seconds:.2f}s")
+                _embedder = embedder
+    return _embedder
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker():
+    """Return the cross-encoder used for reranking, loading it if needed"""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                from sentence_transformers import CrossEncoder
+                started = time.perf_counter()
+                reranker = CrossEncoder(RERANK_MODEL_NAME, device='cpu')
+                logging.info(f"Loaded {RERANK_MODEL_NAME} in {time.perf_counter() - started:.2f}s")
+                _reranker = reranker
+    return _reranker
+
+def load_models():
+    """Load every model the configured pipeline uses"""
+    get_embedder()
+    if RERANK_TOP_N:
+        get_reranker()
+
+def report_model_load(future: asyncio.Future):
+    """Log and keep the error of a background load_models call, for /api/ready"""
+    global model_load_error
+    if future.cancelled() or future.exception() is None:
+        return
+    error = future.exception()
+    model_load_error = f"{type(error).__name__}: {error}"
+    logging.error(f"Error loading models: {model_load_error}")
+
+# Metrics
+STAGE_SECONDS = Histogram(
+    'analysis_stage_seconds',
+    'Time spent in each stage of the analysis pipeline',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+PAGES_EXTRACTED = MetricCounter('pdf_pages_extracted_total', 'PDF pages extracted')
+CHUNKS_EXTRACTED = MetricCounter('chunks_extracted_total', 'Chunks produced by extraction')
+CHUNKS_EMBEDDED = MetricCounter('chunks_embedded_total', 'Chunks encoded by the embedding model')
+TOKENS_EMBEDDED = MetricCounter('tokens_embedded_total', 'Tokens encoded by the embedding model, padding excluded')
+EMBEDDING_BATCH_SIZE = Histogram(
+    'embedding_batch_size',
+    'Texts per embedding model call',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+QUERY_CACHE_LOOKUPS = MetricCounter(
+    'query_embedding_cache_lookups_total',
+    'Query embedding lookups by where the embedding came from',
+    ['source']
+)
+# Gauges are summed over the live worker processes in multiprocess mode
+POOL_PENDING = Gauge(
+    'worker_pool_pending_tasks',
+    'Tasks queued or running in a worker pool',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+ANALYSES_ACTIVE = Gauge('analyses_active', 'Analysis and corpus requests being processed', multiprocess_mode='livesum')
+
+# Stage timings of the current request, when it collects them
+stage_timings: ContextVar[Optional[dict]] = ContextVar('stage_timings', default=None)
+
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = stage_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage: str):
+    """Record the time spent in the with block as a stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+# Profiling
+class ProfileStats:
+    """Raw profile of a pool task, which pstats.Stats accepts like a Profile"""
+    
+    def __init__(self, stats: dict):
+        self.stats = stats
+    
+    def create_stats(self):
+        pass
+
+def profiled_call(fn, *args) -> tuple:
+    """Run fn(*args) under cProfile in a pool worker, returning (result, raw stats)
+
+    The stats are None when another profiler is already active.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return fn(*args), None
+    try:
+        result = fn(*args)
+    finally:
+        profiler.disable()
+    profiler.create_stats()
+    return result, profiler.stats
+
+class RequestProfile:
+    """cProfile of one analysis, merged with the profiles of its pool tasks"""
+    
+    def __init__(self, label: str):
+        self.name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{label}-{uuid.uuid4().hex[:8]}.prof"
+        self.profiler = cProfile.Profile()
+        self.tasks = []
+    
+    def save(self):
+        stats = pstats.Stats(self.profiler)
+        for task in self.tasks:
+            stats.add(task)
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(str(PROFILE_DIR / self.name))
+        
+        # Keep only the most recent profiles
+        profiles = sorted(PROFILE_DIR.glob('*.prof'), key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in profiles[PROFILE_MAX_FILES:]:
+            path.unlink(missing_ok=True)
+
+# The profile collecting the pool tasks of the current analysis, if any
+active_profile: ContextVar[Optional[RequestProfile]] = ContextVar('active_profile', default=None)
+_profiling = False
+
+def is_profile_admin(token: Optional[str]) -> bool:
+    if not (PROFILE_ADMIN_TOKEN and token):
+        return False
+    # Header values arrive decoded as latin-1, and compare_digest refuses
+    # non-ASCII strings, so the raw bytes are compared
+    return hmac.compare_digest(token.encode('latin-1', 'replace'), PROFILE_ADMIN_TOKEN.encode())
+
+def should_profile(token: Optional[str] = None) -> bool:
+    return is_profile_admin(token) or random.random() < PROFILE_SAMPLE_RATE
+
+@asynccontextmanager
+async def profiling(label: str, requested: bool):
+    """Profile the block when requested, yielding its RequestProfile or None
+
+    The event loop thread can only be profiled for one block at a time, so
+    concurrent requests run unprofiled; coroutines of other requests that
+    run in between still show up in the profile.
+    """
+    global _profiling
+    if not requested or _profiling:
+        yield None
+        return
+    
+    profile = RequestProfile(label)
+    try:
+        profile.profiler.enable()
+    except ValueError:  # Another profiler is active
+        yield None
+        return
+    
+    _profiling = True
+    token = active_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        profile.profiler.disable()
+        active_profile.reset(token)
+        _profiling = False
+        await asyncio.to_thread(profile.save)
+        logging.info(f"Saved profile {profile.name}")
+
+# Worker pools
+class WorkerPool:
+    """Executor wrapper that bounds the number of queued and running tasks
+
+    Tasks beyond max_pending wait for a free slot rather than fail: requests
+    are refused up front by AdmissionLimit, so an admitted request always
+    runs to completion. The executor is created by make_executor on first
+    use, so a server imported before forking (gunicorn --preload) gives
+    every worker process its own executor rather than sharing the queues
+    of one created in the parent.
+    """
+    
+    def __init__(self, name: str, make_executor: Callable[[], Executor], max_pending: int):
+        self.name = name
+        self.make_executor = make_executor
+        self.executor = None  # Created on first use, in the serving process
+        self.max_pending = max_pending
+        POOL_PENDING.labels(name)  # Reported as 0 until the first task
+        self._slots = None  # Created on first use, in the serving event loop
+    
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool without blocking the event loop"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self.executor is None:
+            self.executor = self.make_executor()
+        
+        profile = active_profile.get()
+        async with self._slots:
+            POOL_PENDING.labels(self.name).inc()
+            try:
+                if profile is None:
+                    return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+                result, stats = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, profiled_call, fn, *args
+                )
+                if stats is not None:
+                    profile.tasks.append(ProfileStats(stats))
+                return result
+            finally:
+                POOL_PENDING.labels(self.name).dec()
+    
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+def server_busy() -> HTTPException:
+    """503 response telling clients to back off while the server is full"""
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please retry shortly",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+class AdmissionLimit:
+    """Bounds the requests processed at once, refusing the rest with 503
+
+    Checked once when a request starts, so that a request is either turned
+    away before doing any work or admitted and served in full.
+    """
+    
+    def __init__(self, max_active: int):
+        self.max_active = max_active
+        self.active = 0  # Only touched from the event loop thread
+    
+    def acquire(self):
+        if self.active >= self.max_active:
+            logging.warning(f"Rejecting request: {self.active} analyses in progress")
+            raise server_busy()
+        self.active += 1
+        ANALYSES_ACTIVE.inc()
+    
+    def release(self):
+        self.active -= 1
+        ANALYSES_ACTIVE.dec()
+    
+    @contextmanager
+    def admit(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+analysis_admission = AdmissionLimit(MAX_CONCURRENT_ANALYSES)
+
+# PDF parsing is CPU bound and holds the GIL, so it runs in worker processes;
+# the model releases the GIL during inference, so embedding uses threads
+extract_pool = WorkerPool(
+    'extract',
+    lambda: ProcessPoolExecutor(max_workers=EXTRACT_WORKERS),
+    MAX_PENDING_EXTRACT
+)
+embed_pool = WorkerPool(
+    'embed',
+    lambda: ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix='embed'),
+    MAX_PENDING_EMBED
+)
+
+# Embedding cache
+class EmbeddingCache:
+    """Disk store of per-PDF chunks and embeddings, evicted least recently used first
+
+    Entries are addressed by the SHA-256 of the PDF bytes plus everything that
+    influences the chunks or their vectors, so a hit can never be stale.
+    Embedding matrices are memory-mapped on read.
+    """
+    
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def key(self, pdf_sha256: str) -> str:
+        params = {
+            "pdf": pdf_sha256,
+            "model": EMBEDDING_MODEL_NAME,
+            "backend": EMBEDDING_BACKEND,
+            **chunking_params()
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (chunks, embeddings) for key, or None on a miss"""
+        chunks_path = self.directory / f"{key}.json"
+        embeddings_path = self.directory / f"{key}.npy"
+        try:
+            with open(chunks_path) as f:
+                chunks = json.load(f)
+            embeddings = np.load(embeddings_path, mmap_mode='r')
+            # mtime doubles as the last access time for eviction
+            os.utime(embeddings_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return chunks, embeddings
+    
+    def put(self, key: str, chunks: List[dict], embeddings: np.ndarray):
+        """Store an entry atomically, then evict old entries over the size budget"""
+        chunks_path = self.directory / f"{key}.json"
+        embeddings_path = self.directory / f"{key}.npy"
+        
+        # Write the chunks first: readers only treat an entry as present once
+        # its embeddings file exists
+        self._publish(chunks_path, '.json.tmp', 'w', lambda f: json.dump(chunks, f))
+        self._publish(
+            embeddings_path, '.tmp.npy', 'wb',
+            lambda f: np.save(f, np.asarray(embeddings, dtype=np.float32))
+        )
+        self.evict()
+    
+    def _publish(self, path: Path, suffix: str, mode: str, write):
+        """Write a file under a unique temporary name, then move it into place
+
+        Concurrent puts of the same entry each write their own file, so a
+        reader only ever sees one complete version.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{path.stem}.", suffix=suffix)
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+    
+    def evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for embeddings_path in self.directory.glob('*.npy'):
+                if embeddings_path.name.endswith('.tmp.npy'):
+                    continue
+                chunks_path = embeddings_path.with_suffix('.json')
+                try:
+                    stat = embeddings_path.stat()
+                    size = stat.st_size + chunks_path.stat().st_size
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, size, embeddings_path, chunks_path))
+                total += size
+            
+            entries.sort()
+            for _, size, embeddings_path, chunks_path in entries:
+                if total <= self.max_bytes:
+                    break
+                for path in (embeddings_path, chunks_path):
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+                total -= size
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_BYTES)
+
+# Result cache
+class ResultCache:
+    """In-memory LRU of analysis results by cache key, expiring RESULT_CACHE_TTL after analysis
+
+    Results are also stored with their cache_key in document_analyses, which
+    backs the cache across restarts and workers.
+    """
+    
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = timedelta(seconds=ttl)
+        self.entries = OrderedDict()
+    
+    def fresh(self, result: DocumentAnalysisResult) -> bool:
+        return result.timestamp + self.ttl > datetime.utcnow()
+    
+    def get(self, key: str) -> Optional[DocumentAnalysisResult]:
+        result = self.entries.get(key)
+        if result is None:
+            return None
+        if not self.fresh(result):
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return result
+    
+    def put(self, key: str, result: DocumentAnalysisResult):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    async def find(self, key: str) -> Optional[DocumentAnalysisResult]:
+        """Look a result up in memory, then among stored analyses"""
+        result = self.get(key)
+        if result is not None or not self.ttl:
+            return result
+        
+        document = await db.document_analyses.find_one(
+            {"cache_key": key, "timestamp": {"$gt": datetime.utcnow() - self.ttl}},
+            {"_id": 0},
+            sort=[("timestamp", -1)]
+        )
+        if document is None:
+            return None
+        result = DocumentAnalysisResult(**document)
+        self.put(key, result)
+        return result
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+# Query embedding cache
+class QueryEmbeddingCache:
+    """In-memory LRU of normalized query text to query embedding"""
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+    
+    def get(self, key: str) -> Optional[np.ndarray]:
+        embedding = self.entries.get(key)
+        if embedding is not None:
+            self.entries.move_to_end(key)
+        return embedding
+    
+    def put(self, key: str, embedding: np.ndarray):
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+query_cache = QueryEmbeddingCache(QUERY_CACHE_SIZE)
+
+# A PDF given either by the path of a file or by its bytes
+PdfSource = Union[str, bytes, bytearray]
+
+# Corpus index
+class CorpusIndex:
+    """HNSW index over the chunk embeddings of the registered corpus
+
+    Labels are allocated by allocate_corpus_labels; the chunk text and
+    document of every label live in the corpus_chunks collection. The index
+    file is shared by all server processes: changes are made under an
+    exclusive lock on a lock file next to it, to a fresh copy of the latest
+    saved index, and published by atomically replacing the file. Searches
+    use the loaded copy without locking, and reload it once the file has
+    been replaced, so ingestion never blocks queries. Changes may wait on
+    the lock, so callers run them with asyncio.to_thread rather than in the
+    embed pool, whose workers must stay free for the models.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()  # Serializes reloads within the process
+        self._index = None
+        self._version = None
+    
+    def _file_version(self) -> Optional[tuple]:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+    
+    def _load(self) -> hnswlib.Index:
+        index = hnswlib.Index(space='ip', dim=get_embedder().dim)
+        if self.path.exists():
+            index.load_index(str(self.path), allow_replace_deleted=False)
+        else:
+            index.init_index(max_elements=1024, ef_construction=CORPUS_INDEX_EF_CONSTRUCTION, M=CORPUS_INDEX_M)
+        index.set_ef(CORPUS_INDEX_EF_SEARCH)
+        return index
+    
+    def _current(self) -> hnswlib.Index:
+        """The loaded index, reloaded first if another process replaced the file"""
+        version = self._file_version()
+        if self._index is None or version != self._version:
+            with self._lock:
+                if self._index is None or version != self._version:
+                    self._index = self._load()
+                    self._version = version
+        return self._index
+    
+    @contextmanager
+    def _update(self):
+        """Yield the latest saved index to change, then publish it"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix('.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file is closed
+            index = self._load()
+            yield index
+            tmp_path = self.path.with_suffix('.tmp')
+            index.save_index(str(tmp_path))
+            os.replace(tmp_path, self.path)
+            with self._lock:
+                self._index = index
+                self._version = self._file_version()
+    
+    def add(self, embeddings: np.ndarray, labels: List[int]):
+        """Insert embeddings under the given labels"""
+        if not labels:
+            return
+        with self._update() as index:
+            needed = index.get_current_count() + len(labels)
+            if needed > index.get_max_elements():
+                index.resize_index(max(needed, 2 * index.get_max_elements()))
+            index.add_items(embeddings, labels)
+    
+    def remove(self, labels: List[int]):
+        if not labels:
+            return
+        with self._update() as index:
+            for label in labels:
+                index.mark_deleted(label)
+    
+    def search(self, query_embedding: np.ndarray, k: int) -> tuple:
+        """Return (labels, cosine similarities) of the k nearest chunks"""
+        index = self._current()
+        index.set_ef(max(CORPUS_INDEX_EF_SEARCH, k))
+        labels, distances = index.knn_query(query_embedding, k=k)
+        # Inner product space reports 1 - dot product as the distance
+        return labels[0].tolist(), (1.0 - distances[0]).tolist()
+
+corpus_index = CorpusIndex(CORPUS_DIR / 'chunks.hnsw')
+CORPUS_LABEL_COUNTER = "corpus_chunk_label"
+
 # Helper functions
+SENTENCE_PATTERN = re.compile(r'[^\s.!?][^.!?]*(?:[.!?]+|$)')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+TERM_PATTERN = re.compile(r'\w+')
+NEWLINES_PATTERN = re.compile(r'\n+')
+
+_tokenizer = None
+
 def clean_text(text: str) -> str:
     """Clean and normalize text"""
-    text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with single space
-    text = re.sub(r'\n+', '\n', text)  # Replace multiple newlines with single newline
+    text = WHITESPACE_PATTERN.sub(' ', text)  # Replace multiple spaces with single space
+    text = NEWLINES_PATTERN.sub('\n', text)  # Replace multiple newlines with single newline
     text = text.strip()
     return text
 
-def extract_text_from_pdf(pdf_path: str) -> List[dict]:
-    """Extract text from PDF with page numbers"""
-    doc = fitz.open(pdf_path)
-    pages_text = []
-    
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        text = page.get_text()
-        if text.strip():  # Only add non-empty pages
-            pages_text.append({
-                "page": page_num + 1,
-                "text": clean_text(text)
-            })
+def open_pdf(source: PdfSource) -> fitz.Document:
+    """Open a PDF from a file path or straight from its bytes"""
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+def count_pdf_pages(source: PdfSource) -> int:
+    """Number of pages in a PDF"""
+    with open_pdf(source) as doc:
+        return len(doc)
+
+def extract_text_from_pdf(source: PdfSource, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+    """Extract text from PDF with page numbers, yielding one page at a time
+
+    Only pages in [start, stop) are read, so page ranges of one document can
+    be extracted by separate processes, each with its own handle.
+    """
+    with open_pdf(source) as doc:
+        stop = len(doc) if stop is None else min(stop, len(doc))
+        
+        for page_num in range(start, stop):
+            page = doc.load_page(page_num)
+            text = page.get_text()
+            if text.strip():  # Only yield non-empty pages
+                yield {
+                    "page": page_num + 1,
+                    "text": clean_text(text)
+                }
+
+def is_heading(text: str, size: float, bold: bool, body_size: float) -> bool:
+    """Whether a line looks like a heading given the body text font size"""
+    if len(text) > MAX_HEADING_LENGTH or not any(c.isalpha() for c in text) or text.endswith('.'):
+        return False
+    return size >= body_size * HEADING_SIZE_RATIO or (bold and size >= body_size)
+
+def extract_sections(source: PdfSource, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+    """Extract the sections of a page range, split at detected headings
+
+    Yields dicts with the section title (None before the first heading), its
+    first and last page, its text, and page_starts: (offset, page) pairs
+    giving the page each part of the text comes from. The body font size is
+    estimated per range, and sections never span two ranges.
+    """
+    lines = []  # (page, text, size, bold)
+    with open_pdf(source) as doc:
+        stop = len(doc) if stop is None else min(stop, len(doc))
+        
+        for page_num in range(start, stop):
+            blocks = doc.load_page(page_num).get_text("dict")["blocks"]
+            for block in blocks:
+                if block.get("type") != 0:  # Skip image blocks
+                    continue
+                for line in block["lines"]:
+                    spans = [span for span in line["spans"] if span["text"].strip()]
+                    if not spans:
+                        continue
+                    lines.append((
+                        page_num + 1,
+                        clean_text("".join(span["text"] for span in line["spans"])),
+                        max(span["size"] for span in spans),
+                        all(span["flags"] & 16 for span in spans)  # Bit 4 marks bold fonts
+                    ))
     
-    doc.close()
-    return pages_text
+    # The most common size by amount of text is the body text size
+    sizes = Counter()
+    for _, text, size, _ in lines:
+        sizes[round(size, 1)] += len(text)
+    body_size = sizes.most_common(1)[0][0] if sizes else 0.0
+    
+    section = None
+    for page, text, size, bold in lines:
+        if is_heading(text, size, bold, body_size):
+            if section and section["parts"]:
+                yield finish_section(section)
+                section = None
+            if section is None:
+                section = {"title": text, "page": page, "page_end": page, "parts": []}
+            else:  # Headings spanning several lines
+                section["title"] += " " + text
+            continue
+        
+        if section is None:
+            section = {"title": None, "page": page, "page_end": page, "parts": []}
+        section["parts"].append((page, text))
+        section["page_end"] = page
+    
+    if section and section["parts"]:
+        yield finish_section(section)
 
-def chunk_text(text: str, max_length: int = 500) -> List[str]:
-    """Split text into chunks of reasonable size"""
-    sentences = re.split(r'[.!?]+', text)
+def finish_section(section: dict) -> dict:
+    """Join the lines of a section, remembering where each page starts"""
+    page_starts = []
+    offset = 0
+    for page, text in section["parts"]:
+        if not page_starts or page_starts[-1][1] != page:
+            page_starts.append((offset, page))
+        offset += len(text) + 1
+    return {
+        "title": section["title"],
+        "page": section["page"],
+        "page_end": section["page_end"],
+        "text": " ".join(text for _, text in section["parts"]),
+        "page_starts": page_starts
+    }
+
+def sentence_spans(text: str) -> List[tuple]:
+    """(start, end) offsets of the sentences in text, terminators included"""
+    spans = []
+    for match in SENTENCE_PATTERN.finditer(text):
+        start, end = match.span()
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        spans.append((start, end))
+    return spans
+
+def get_tokenizer():
+    """Tokenizer of the embedding model, loaded once per process"""
+    global _tokenizer
+    if _tokenizer is None:
+        from transformers import AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+    return _tokenizer
+
+def chunk_spans(
+    text: str,
+    max_length: int = 500,
+    max_tokens: Optional[int] = None,
+    overlap: int = 0
+) -> List[tuple]:
+    """Group whole sentences into chunks in a single pass
+
+    Chunks stay under max_length characters, or under max_tokens model tokens
+    when given, in which case sentences longer than the budget are split at
+    token boundaries. Consecutive chunks share up to overlap sentences.
+    Returns (start, end, size) tuples, where start and end are offsets into
+    text and size is the chunk length in the budget's unit.
+    """
+    spans = sentence_spans(text)
+    
+    # Units are (start, end, size) pieces that are never split further
+    if max_tokens:
+        budget = max_tokens + 1  # Same strict comparison as for characters
+        encoded = get_tokenizer()(
+            [text[start:end] for start, end in spans],
+            add_special_tokens=False,
+            return_offsets_mapping=True
+        )
+        units = []
+        for (start, _), offsets in zip(spans, encoded["offset_mapping"]):
+            for i in range(0, len(offsets), max_tokens):
+                window = offsets[i:i + max_tokens]
+                units.append((start + window[0][0], start + window[-1][1], len(window)))
+    else:
+        budget = max_length
+        units = [(start, end, end - start + 1) for start, end in spans]  # + 1 for the separator
+    
     chunks = []
-    current_chunk = ""
+    current = []  # Indices into units
+    size = 0
+    for i, (_, _, unit_size) in enumerate(units):
+        if current and size + unit_size >= budget:
+            chunks.append((units[current[0]][0], units[current[-1]][1], size))
+            current = current[-overlap:] if overlap else []
+            size = sum(units[j][2] for j in current)
+            while current and size + unit_size >= budget:
+                size -= units[current.pop(0)][2]
+        current.append(i)
+        size += unit_size
     
-    for sentence in sentences:
-        sentence = sentence.strip()
-        if not sentence:
-            continue
-            
-        if len(current_chunk) + len(sentence) < max_length:
-            current_chunk += sentence + ". "
-        else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = sentence + ". "
+    if current:
+        chunks.append((units[current[0]][0], units[current[-1]][1], size))
     
-    if current_chunk:
-        chunks.append(current_chunk.strip())
+    return chunks
+
+def chunking_params() -> dict:
+    """Settings that determine the chunks produced for a PDF"""
+    return {
+        "chunker": 2,
+        "mode": CHUNK_MODE,
+        "max_length": CHUNK_MAX_LENGTH,
+        "max_tokens": CHUNK_MAX_TOKENS,
+        "overlap": CHUNK_OVERLAP,
+        "min_length": MIN_CHUNK_LENGTH,
+        "extraction": EXTRACTION_MODE,
+        "dedup": f"near:{NEAR_DUPLICATE_JACCARD}" if DEDUP_MODE == 'near' else DEDUP_MODE,
+        "heading_size_ratio": HEADING_SIZE_RATIO
+    }
+
+def pipeline_config() -> dict:
+    """The settings that shape analysis results, for keying cached results"""
+    return {
+        **chunking_params(),
+        "model": EMBEDDING_MODEL_NAME,
+        "backend": EMBEDDING_BACKEND,
+        "ranking": RANKING_MODE,
+        "fusion_weight": FUSION_WEIGHT,
+        "prefilter": BM25_PREFILTER,
+        "mmr_lambda": MMR_LAMBDA,
+        "mmr_candidates": MMR_CANDIDATES,
+        "max_per_document": MAX_SECTIONS_PER_DOCUMENT,
+        "rerank_model": RERANK_MODEL_NAME,
+        "rerank_top_n": RERANK_TOP_N,
+        "rerank_budget_ms": RERANK_BUDGET_MS,
+        "summary": SUMMARY_MODE,
+        "summary_lambda": SUMMARY_MMR_LAMBDA
+    }
+
+def extract_chunks(
+    source: PdfSource,
+    start: int = 0,
+    stop: Optional[int] = None,
+    timings: Optional[dict] = None
+) -> List[dict]:
+    """Extract and chunk a page range of a PDF, returning the chunks worth embedding
+
+    Every chunk records its page and its [start, end) offsets in the page
+    text. In layout mode chunks stay within one section instead; they carry
+    the section title and last page, and offsets refer to the section text.
+    If given, timings receives the seconds spent extracting and chunking.
+    """
+    max_tokens = CHUNK_MAX_TOKENS if CHUNK_MODE == 'tokens' else None
+    started = time.perf_counter()
     
+    if EXTRACTION_MODE == 'layout':
+        sections = list(extract_sections(source, start, stop))
+    else:
+        sections = [
+            {"title": None, "page": page_data["page"], "text": page_data["text"], "page_starts": [(0, page_data["page"])]}
+            for page_data in extract_text_from_pdf(source, start, stop)
+        ]
+    extracted = time.perf_counter()
+    
+    chunks = []
+    for section in sections:
+        text = section["text"]
+        offsets = [offset for offset, _ in section["page_starts"]]
+        for chunk_start, chunk_end, size in chunk_spans(text, CHUNK_MAX_LENGTH, max_tokens, CHUNK_OVERLAP):
+            if chunk_end - chunk_start < MIN_CHUNK_LENGTH:  # Skip very short chunks
+                continue
+            chunk = {
+                "page": section["page_starts"][bisect.bisect_right(offsets, chunk_start) - 1][1],
+                "text": text[chunk_start:chunk_end],
+                "start": chunk_start,
+                "end": chunk_end
+            }
+            if EXTRACTION_MODE == 'layout':
+                chunk["title"] = section["title"]
+                chunk["page_end"] = section["page_starts"][bisect.bisect_right(offsets, chunk_end - 1) - 1][1]
+            if max_tokens:
+                chunk["tokens"] = size
+            chunks.append(chunk)
+    
+    if timings is not None:
+        timings["extract"] = extracted - started
+        timings["chunk"] = time.perf_counter() - extracted
+    return chunks
+
+def extract_chunks_timed(source: PdfSource, start: int, stop: int) -> tuple:
+    """extract_chunks for worker processes, returning (chunks, timings)"""
+    timings = {}
+    return extract_chunks(source, start, stop, timings), timings
+
+async def run_extraction(source: PdfSource, start: int, stop: int) -> List[dict]:
+    """Extract and chunk a page range in the extraction pool, recording its metrics"""
+    chunks, timings = await extract_pool.run(extract_chunks_timed, source, start, stop)
+    for stage, seconds in timings.items():
+        record_stage(stage, seconds)
+    PAGES_EXTRACTED.inc(stop - start)
+    CHUNKS_EXTRACTED.inc(len(chunks))
     return chunks
 
 def generate_summary(text: str, max_length: int = 200) -> str:
@@ -131,82 +1253,1196 @@ def generate_summary(text: str, max_length: int = 200) -> str:
     
     return summary.strip() if summary else text[:max_length]
 
-async def process_documents(files: List[UploadFile], persona: str, job: str) -> DocumentAnalysisResult:
-    """Process uploaded documents and return analysis results"""
+def query_summaries(texts: List[str], query_embedding: np.ndarray, max_length: int = SUMMARY_MAX_LENGTH) -> List[str]:
+    """Summarize texts by their sentences most relevant to the query
+
+    The sentences of all texts are encoded in one batch. Each summary takes
+    sentences in MMR order while they fit in max_length and lists them in
+    their original order.
+    """
+    text_sentences = [[text[start:end] for start, end in sentence_spans(text)] for text in texts]
+    sentence_embeddings = embed_texts([sentence for sentences in text_sentences for sentence in sentences])
+    relevance = sentence_embeddings @ query_embedding
     
-    # Create query embedding
-    query_text = f"Persona: {persona}. Job: {job}."
-    query_embedding = model.encode([query_text])
+    summaries = []
+    offset = 0
+    for text, sentences in zip(texts, text_sentences):
+        window = slice(offset, offset + len(sentences))
+        offset += len(sentences)
+        
+        chosen, length = [], 0
+        for j in mmr_select(sentence_embeddings[window], relevance[window], len(sentences), SUMMARY_MMR_LAMBDA):
+            if length + len(sentences[j]) < max_length:
+                chosen.append(j)
+                length += len(sentences[j]) + 1
+        summaries.append(" ".join(sentences[j] for j in sorted(chosen)) if chosen else text[:max_length])
     
-    all_sections = []
+    return summaries
+
+async def summarize(texts: List[str], query_embedding: np.ndarray) -> List[str]:
+    """Summarize the texts of ranked sections according to SUMMARY_MODE"""
+    if SUMMARY_MODE == 'query':
+        return await embed_pool.run(query_summaries, texts, query_embedding)
+    return [generate_summary(text) for text in texts]
+
+def embed_texts(texts: List[str], batch_size: int = EMBED_BATCH_SIZE, embedder=None) -> np.ndarray:
+    """Encode texts in length-sorted batches into L2-normalized float32 embeddings"""
+    embedder = embedder or get_embedder()
+    embeddings = np.empty((len(texts), embedder.dim), dtype=np.float32)
     
-    for file in files:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
+    # Longest first, so every batch pads to texts of similar length
+    order = np.argsort([-len(text) for text in texts], kind='stable')
+    for start in range(0, len(texts), batch_size):
+        batch_idx = order[start:start + batch_size]
+        embeddings[batch_idx] = embedder.encode([texts[i] for i in batch_idx])
+        EMBEDDING_BATCH_SIZE.observe(len(batch_idx))
+    
+    return embeddings
+
+# Universal hashes (a * x + b) mod p over 32-bit shingle hashes, one per permutation
+MINHASH_PRIME = np.uint64(4294967311)  # Smallest prime above 2 ** 32
+_minhash_rng = np.random.default_rng(0)
+MINHASH_A = _minhash_rng.integers(1, 1 << 32, MINHASH_PERMUTATIONS, dtype=np.uint64)
+MINHASH_B = _minhash_rng.integers(0, 1 << 32, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature of the word pairs of a text
+
+    The share of equal entries in two signatures estimates the Jaccard
+    similarity of the texts' word pair sets. Pairs rather than single words
+    keep local word order relevant; a one-word edit changes at most two.
+    """
+    words = TERM_PATTERN.findall(text.lower())
+    shingles = {" ".join(words[i:i + 2]) for i in range(max(len(words) - 1, 1))}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), 'little') for shingle in shingles],
+        dtype=np.uint64
+    )
+    return ((hashes[:, None] * MINHASH_A + MINHASH_B) % MINHASH_PRIME).min(axis=0)
+
+class ChunkDeduplicator:
+    """Embeds chunks of one request, reusing embeddings for repeated text
+
+    Exact repeats are found by a digest of the text and, in 'near' mode,
+    near repeats by MinHash. Signatures are split into MINHASH_BANDS bands
+    used as LSH buckets, so only signatures sharing a band are compared.
+    Texts are matched against earlier batches and within their own batch.
+    Sources of texts that reuse the embedding of a near repeat from another
+    source are collected in borrowed: their embeddings depend on the other
+    sources, so they must not be cached as their own.
+    """
+    
+    def __init__(self, mode: str = DEDUP_MODE):
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.exact = {}  # Digest -> (embedding, source)
+        self.buckets = {}  # (band, band values) -> [(signature, (embedding, source))]
+        self.borrowed = set()
+        self.embedded = 0
+        self.reused = 0
+    
+    def find(self, exact: dict, buckets: dict, digest: bytes, signature: Optional[np.ndarray]) -> tuple:
+        """Return the value registered for a text, and whether it is only a near repeat"""
+        if digest in exact:
+            return exact[digest], False
+        if signature is not None:
+            for band in self.bands(signature):
+                for other, value in buckets.get(band, ()):
+                    if np.mean(signature == other) >= NEAR_DUPLICATE_JACCARD:
+                        return value, True
+        return None, False
+    
+    def register(self, exact: dict, buckets: dict, digest: bytes, signature: Optional[np.ndarray], value):
+        exact[digest] = value
+        if signature is not None:
+            for band in self.bands(signature):
+                buckets.setdefault(band, []).append((signature, value))
+    
+    @staticmethod
+    def bands(signature: np.ndarray) -> List[tuple]:
+        return [(band, rows.tobytes()) for band, rows in enumerate(np.split(signature, MINHASH_BANDS))]
+    
+    def embed(self, texts: List[str], sources: Optional[list] = None, embedder=None) -> np.ndarray:
+        """Embed texts like embed_texts, encoding every distinct text only once
+
+        sources gives the source of every text, such as the file it is from.
+        """
+        if self.mode == 'off':
+            CHUNKS_EMBEDDED.inc(len(texts))
+            return embed_texts(texts, embedder=embedder)
         
-        try:
-            # Extract text from PDF
-            pages_text = extract_text_from_pdf(tmp_file_path)
+        embedder = embedder or get_embedder()
+        digests = [hashlib.blake2b(text.lower().encode(), digest_size=16).digest() for text in texts]
+        signatures = [minhash(text) for text in texts] if self.mode == 'near' else [None] * len(texts)
+        sources = sources or [None] * len(texts)
+        embeddings = np.empty((len(texts), embedder.dim), dtype=np.float32)
+        
+        # Rows to encode, and rows copying a row of this batch
+        unique, copies = [], []
+        batch_exact, batch_buckets = {}, {}
+        with self.lock:
+            for i in range(len(texts)):
+                known, near = self.find(self.exact, self.buckets, digests[i], signatures[i])
+                if known is not None:
+                    embeddings[i], source = known
+                    if near and source != sources[i]:
+                        self.borrowed.add(sources[i])
+                    continue
+                row, near = self.find(batch_exact, batch_buckets, digests[i], signatures[i])
+                if row is not None:
+                    if near and sources[row] != sources[i]:
+                        self.borrowed.add(sources[i])
+                    copies.append((i, row))
+                    continue
+                self.register(batch_exact, batch_buckets, digests[i], signatures[i], i)
+                unique.append(i)
+        
+        embeddings[unique] = embed_texts([texts[i] for i in unique], embedder=embedder)
+        for i, row in copies:
+            embeddings[i] = embeddings[row]
+        
+        with self.lock:
+            for i in unique:
+                self.register(self.exact, self.buckets, digests[i], signatures[i], (embeddings[i], sources[i]))
+            self.embedded += len(unique)
+            self.reused += len(texts) - len(unique)
+        CHUNKS_EMBEDDED.inc(len(unique))
+        return embeddings
+
+async def read_upload(file: UploadFile) -> tuple:
+    """Read an upload into a PDF source, returning (sha256 hex digest, source)
+
+    The bytes are kept in memory up to INMEMORY_PDF_MAX_BYTES. Past that the
+    upload is streamed block by block to a temporary file whose path becomes
+    the source, so a large PDF is never held in memory as a whole.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    tmp_path = None
+    tmp_file = None
+    
+    try:
+        while True:
+            block = await file.read(UPLOAD_READ_BLOCK_BYTES)
+            if not block:
+                break
+            digest.update(block)
             
-            for page_data in pages_text:
-                page_num = page_data["page"]
-                text = page_data["text"]
-                
-                # Split text into chunks
-                chunks = chunk_text(text)
-                
-                for chunk in chunks:
-                    if len(chunk) < 50:  # Skip very short chunks
-                        continue
-                    
-                    # Generate embedding for this chunk
-                    chunk_embedding = model.encode([chunk])
-                    
-                    # Calculate similarity
-                    similarity = cosine_similarity(query_embedding, chunk_embedding)[0][0]
-                    
-                    # Generate summary
-                    summary = generate_summary(chunk)
-                    
-                    all_sections.append({
-                        "page": page_num,
-                        "text": chunk,
-                        "score": float(similarity),
-                        "summary": summary
-                    })
+            if tmp_file is None and len(buffer) + len(block) > INMEMORY_PDF_MAX_BYTES:
+                fd, tmp_path = tempfile.mkstemp(suffix='.pdf')
+                os.close(fd)
+                tmp_file = await aiofiles.open(tmp_path, 'wb')
+                await tmp_file.write(buffer)
+                buffer = None
+            
+            if tmp_file is None:
+                buffer += block
+            else:
+                await tmp_file.write(block)
         
-        finally:
-            # Clean up temporary file
-            os.unlink(tmp_file_path)
+        if tmp_file is not None:
+            await tmp_file.close()
+    except BaseException:
+        if tmp_file is not None:
+            await tmp_file.close()
+        if tmp_path is not None:
+            os.unlink(tmp_path)
+        raise
+    
+    if tmp_file is None:
+        return digest.hexdigest(), buffer
+    
+    return digest.hexdigest(), tmp_path
+
+def release_pdf_source(source: PdfSource):
+    """Delete the temporary file behind a spooled upload"""
+    if isinstance(source, str):
+        os.unlink(source)
+
+async def read_uploads(files: List[UploadFile]) -> List[dict]:
+    """Read all uploads into dicts with their filename, sha256 and PDF source
+
+    The caller owns the sources and must hand the list to release_uploads.
+    """
+    uploads = []
+    try:
+        with timed("read"):
+            for file in files:
+                pdf_sha256, source = await read_upload(file)
+                uploads.append({"filename": file.filename, "sha256": pdf_sha256, "source": source})
+    except BaseException:
+        release_uploads(uploads)
+        raise
+    return uploads
+
+def release_uploads(uploads: List[dict]):
+    for upload in uploads:
+        release_pdf_source(upload["source"])
+
+def spool_split_sources(sources: List[PdfSource], units: List[tuple]) -> tuple:
+    """Spool in-memory PDFs that are extracted in several page ranges to temporary files
+
+    Every extraction task pickles its source into a worker process, so a PDF
+    held in memory would be copied once per range; the path of its spooled
+    copy is passed instead. Returns the sources to extract from and the
+    spooled paths, which the caller releases with release_pdf_source.
+    """
+    ranges = Counter(i for i, _, _ in units)
+    spooled = {}
+    try:
+        for i, count in ranges.items():
+            if count > 1 and not isinstance(sources[i], str):
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+                    spooled[i] = tmp_file.name
+                    tmp_file.write(sources[i])
+    except BaseException:
+        for path in spooled.values():
+            release_pdf_source(path)
+        raise
+    return [spooled.get(i, source) for i, source in enumerate(sources)], list(spooled.values())
+
+def extraction_units(page_counts: List[int], progress: bool = False) -> List[tuple]:
+    """Split files into (file index, start page, stop page) work units, in document order
+
+    With progress, text mode ranges are capped at PROGRESS_PAGES_PER_TASK
+    pages; chunks never cross pages there, so the split leaves them unchanged.
+    """
+    units = []
+    for i, page_count in enumerate(page_counts):
+        step = PAGES_PER_TASK if page_count >= PARALLEL_EXTRACT_MIN_PAGES else max(page_count, 1)
+        if progress and EXTRACTION_MODE == 'text':
+            step = min(step, PROGRESS_PAGES_PER_TASK)
+        units.extend((i, start, min(start + step, page_count)) for start in range(0, page_count, step))
+    return units
+
+async def extract_all(sources: List[PdfSource], progress=None) -> List[List[dict]]:
+    """Extract and chunk PDFs without embedding them, returning the chunks of every file"""
+    page_counts = await asyncio.gather(*(asyncio.to_thread(count_pdf_pages, source) for source in sources))
+    units = extraction_units(page_counts, progress is not None)
+    task_sources, spooled = await asyncio.to_thread(spool_split_sources, sources, units)
+    extract_slots = asyncio.Semaphore(EXTRACT_WORKERS * 2)
+    
+    async def extract(i: int, start: int, stop: int) -> List[dict]:
+        async with extract_slots:
+            chunks = await run_extraction(task_sources[i], start, stop)
+        if progress:
+            await progress({
+                "event": "pages",
+                "file": i,
+                "start": start + 1,
+                "stop": stop,
+                "pages": page_counts[i],
+                "chunks": len(chunks)
+            })
+        return chunks
+    
+    try:
+        unit_chunks = await asyncio.gather(*(extract(*unit) for unit in units))
+    finally:
+        for path in spooled:
+            release_pdf_source(path)
+    
+    file_chunks = [[] for _ in sources]
+    for (i, _, _), chunks in zip(units, unit_chunks):
+        file_chunks[i].extend(chunks)
+    return file_chunks
+
+async def extract_and_embed(sources: List[PdfSource], progress=None) -> tuple:
+    """Extract, chunk and embed PDFs, overlapping extraction with inference
+
+    Returns the chunk list and embedding matrix of every file, in input order,
+    and the set of files whose embeddings reuse those of near-duplicate chunks
+    of other files (see ChunkDeduplicator). If given, the async progress callback receives a "pages" event for every
+    extracted page range (see extraction_units) and an "embedded" event with
+    the chunks and embeddings of every embedded batch.
+    """
+    page_counts = await asyncio.gather(*(asyncio.to_thread(count_pdf_pages, source) for source in sources))
+    units = extraction_units(page_counts, progress is not None)
+    task_sources, spooled = await asyncio.to_thread(spool_split_sources, sources, units)
+    
+    unit_chunks = [None] * len(units)
+    unit_embeddings = [None] * len(units)
     
-    # Sort by score (descending) and take top 10
-    all_sections.sort(key=lambda x: x["score"], reverse=True)
-    top_sections = all_sections[:10]
+    # Keep a single request from filling the shared pools on its own
+    extract_slots = asyncio.Semaphore(EXTRACT_WORKERS * 2)
+    embed_slots = asyncio.Semaphore(EMBED_WORKERS + 1)
+    dedup = ChunkDeduplicator()
     
-    # Add rank
-    for i, section in enumerate(top_sections):
-        section["rank"] = i + 1
+    async def extract(u: int) -> int:
+        async with extract_slots:
+            i, start, stop = units[u]
+            unit_chunks[u] = await run_extraction(task_sources[i], start, stop)
+        return u
+    
+    async def embed(batch: List[int]):
+        async with embed_slots:
+            texts = [chunk["text"] for u in batch for chunk in unit_chunks[u]]
+            files = [units[u][0] for u in batch for _ in unit_chunks[u]]
+            with timed("embed"):
+                embeddings = await embed_pool.run(dedup.embed, texts, files)
+        offset = 0
+        for u in batch:
+            unit_embeddings[u] = embeddings[offset:offset + len(unit_chunks[u])]
+            offset += len(unit_chunks[u])
+        if progress:
+            await progress({
+                "event": "embedded",
+                "chunks": [chunk for u in batch for chunk in unit_chunks[u]],
+                "embeddings": embeddings
+            })
+    
+    extract_tasks = [asyncio.ensure_future(extract(u)) for u in range(len(units))]
+    embed_tasks = []
+    try:
+        # Embed finished ranges while later ones are still being extracted
+        batch, batch_chunks = [], 0
+        for next_done in asyncio.as_completed(extract_tasks):
+            u = await next_done
+            if progress:
+                i, start, stop = units[u]
+                await progress({
+                    "event": "pages",
+                    "file": i,
+                    "start": start + 1,
+                    "stop": stop,
+                    "pages": page_counts[i],
+                    "chunks": len(unit_chunks[u])
+                })
+            batch.append(u)
+            batch_chunks += len(unit_chunks[u])
+            if batch_chunks >= EMBED_FLUSH_CHUNKS:
+                embed_tasks.append(asyncio.ensure_future(embed(batch)))
+                batch, batch_chunks = [], 0
+        if batch:
+            embed_tasks.append(asyncio.ensure_future(embed(batch)))
+        await asyncio.gather(*embed_tasks)
+    except BaseException:
+        for task in extract_tasks + embed_tasks:
+            task.cancel()
+        raise
+    finally:
+        for path in spooled:
+            release_pdf_source(path)
+    
+    if dedup.reused:
+        logging.info(f"Embedded {dedup.embedded} chunks, reused embeddings for {dedup.reused} duplicates")
+    
+    file_chunks = [[] for _ in sources]
+    file_units = [[] for _ in sources]
+    for u, (i, _, _) in enumerate(units):
+        file_chunks[i].extend(unit_chunks[u])
+        file_units[i].append(unit_embeddings[u])
+    
+    file_embeddings = [
+        np.concatenate(embeddings) if embeddings else np.zeros((0, get_embedder().dim), dtype=np.float32)
+        for embeddings in file_units
+    ]
+    return file_chunks, file_embeddings, dedup.borrowed
+
+async def embed_uploads(uploads: List[dict], progress=None, prefilter_query: Optional[str] = None) -> tuple:
+    """Chunk and embed uploaded PDFs
+
+    Returns the chunk list and embedding matrix of every upload, as two lists
+    in upload order. Progress events name files by their filename. Given a
+    prefilter_query and BM25_PREFILTER, uncached uploads only keep the chunks
+    that BM25 ranks highest for it; these partial results are not cached.
+    """
+    file_chunks = [None] * len(uploads)
+    file_embeddings = [None] * len(uploads)
+    cache_keys = [embedding_cache.key(upload["sha256"]) for upload in uploads]
+    
+    # Reuse cached chunks and embeddings of PDFs seen before; reading an entry
+    # parses its chunks file, so lookups run off the event loop
+    entries = await asyncio.gather(*[asyncio.to_thread(embedding_cache.get, key) for key in cache_keys])
+    missing = []
+    for i, (upload, cached) in enumerate(zip(uploads, entries)):
+        if cached:
+            file_chunks[i], file_embeddings[i] = cached
+        else:
+            missing.append(i)
+        
+        if progress:
+            await progress({
+                "event": "file",
+                "file": upload["filename"],
+                "cached": bool(cached),
+                "chunks": len(file_chunks[i]) if cached else None
+            })
+            if cached:
+                await progress({"event": "embedded", "chunks": file_chunks[i], "embeddings": file_embeddings[i]})
+    
+    async def forward(event: dict):
+        if "file" in event:
+            event = {**event, "file": uploads[missing[event["file"]]]["filename"]}
+        await progress(event)
+    
+    if prefilter_query and BM25_PREFILTER and missing:
+        new_chunks, new_embeddings = await prefilter_and_embed(
+            [uploads[i]["source"] for i in missing],
+            prefilter_query,
+            forward if progress else None
+        )
+        for j, i in enumerate(missing):
+            file_chunks[i] = new_chunks[j]
+            file_embeddings[i] = new_embeddings[j]
+        return file_chunks, file_embeddings
+    
+    # Extract, chunk and embed the remaining files
+    new_chunks, new_embeddings, borrowed = await extract_and_embed(
+        [uploads[i]["source"] for i in missing],
+        forward if progress else None
+    )
+    
+    for j, i in enumerate(missing):
+        file_chunks[i] = new_chunks[j]
+        file_embeddings[i] = new_embeddings[j]
+        # Embeddings borrowed from other uploads would outlive this request
+        if j not in borrowed:
+            await asyncio.to_thread(embedding_cache.put, cache_keys[i], file_chunks[i], file_embeddings[i])
+    
+    return file_chunks, file_embeddings
+
+async def prefilter_and_embed(sources: List[PdfSource], query_text: str, progress=None) -> tuple:
+    """Extract PDFs and embed only the BM25_PREFILTER chunks BM25 ranks highest for the query
+
+    Returns the kept chunks and their embeddings for every file, in document order.
+    """
+    file_chunks = await extract_all(sources, progress)
+    chunks = [(i, chunk) for i, chunks_of_file in enumerate(file_chunks) for chunk in chunks_of_file]
+    
+    with timed("prefilter"):
+        lexical = (await asyncio.to_thread(bm25_scores, [chunk["text"] for _, chunk in chunks], [query_text]))[0]
+    keep = np.sort(top_k_indices(lexical, BM25_PREFILTER))
+    kept = [chunks[j] for j in keep]
+    with timed("embed"):
+        embeddings = await embed_pool.run(ChunkDeduplicator().embed, [chunk["text"] for _, chunk in kept])
+    if progress:
+        await progress({"event": "embedded", "chunks": [chunk for _, chunk in kept], "embeddings": embeddings})
+    
+    kept_files = np.array([i for i, _ in kept], dtype=np.intp)
+    return (
+        [[chunk for i, chunk in kept if i == file] for file in range(len(sources))],
+        [embeddings[kept_files == file] for file in range(len(sources))]
+    )
+
+class BM25Index:
+    """Okapi BM25 over a list of texts, kept as a sparse term x text weight matrix"""
+    
+    def __init__(self, texts: List[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.vocabulary = {}
+        rows, cols = [], []
+        for j, text in enumerate(texts):
+            for term in TERM_PATTERN.findall(text.lower()):
+                rows.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                cols.append(j)
+        
+        # Duplicate (term, text) entries are summed into term frequencies
+        tf = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(self.vocabulary), len(texts))
+        )
+        lengths = np.asarray(tf.sum(axis=0)).ravel()
+        doc_freqs = np.diff(tf.indptr)
+        idf = np.log1p((len(texts) - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        
+        # Precompute the BM25 weight of every nonzero entry
+        norms = k1 * (1 - b + b * lengths / max(lengths.mean(), 1.0)) if len(texts) else lengths
+        term_ids = np.repeat(np.arange(len(self.vocabulary)), doc_freqs)
+        tf.data = idf[term_ids] * tf.data * (k1 + 1) / (tf.data + norms[tf.indices])
+        self.weights = tf
+    
+    def scores(self, queries: List[str]) -> np.ndarray:
+        """BM25 scores of every text for each query, as a query x text matrix"""
+        rows, cols = [], []
+        for i, query in enumerate(queries):
+            for term in TERM_PATTERN.findall(query.lower()):
+                if term in self.vocabulary:
+                    rows.append(i)
+                    cols.append(self.vocabulary[term])
+        query_terms = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(queries), len(self.vocabulary))
+        )
+        return (query_terms @ self.weights).toarray()
+
+def bm25_scores(texts: List[str], queries: List[str]) -> np.ndarray:
+    return BM25Index(texts).scores(queries)
+
+def fuse_scores(dense: np.ndarray, lexical: np.ndarray, mode: str = RANKING_MODE) -> np.ndarray:
+    """Fuse embedding and BM25 scores of the same chunks along the last axis"""
+    if mode == 'rrf':
+        # Chunks without any query term get no lexical contribution
+        return reciprocal_ranks(dense) + np.where(lexical > 0, reciprocal_ranks(lexical), 0.0)
+    return FUSION_WEIGHT * min_max_normalize(dense) + (1 - FUSION_WEIGHT) * min_max_normalize(lexical)
+
+def reciprocal_ranks(scores: np.ndarray) -> np.ndarray:
+    order = np.argsort(-scores, axis=-1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.broadcast_to(np.arange(scores.shape[-1]), order.shape), axis=-1)
+    return 1.0 / (RRF_K + ranks + 1)
+
+def min_max_normalize(scores: np.ndarray) -> np.ndarray:
+    low = scores.min(axis=-1, keepdims=True) if scores.size else 0.0
+    high = scores.max(axis=-1, keepdims=True) if scores.size else 0.0
+    return (scores - low) / np.maximum(high - low, 1e-9)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without sorting all of them"""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.zeros(0, dtype=np.intp)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+def mmr_select(
+    embeddings: np.ndarray,
+    relevance: np.ndarray,
+    k: int,
+    lambda_: float,
+    groups: Optional[np.ndarray] = None,
+    max_per_group: int = 0
+) -> List[int]:
+    """Pick up to k rows by maximal marginal relevance, in selection order
+
+    Each step takes the row maximizing lambda_ * relevance - (1 - lambda_) *
+    its highest similarity to the rows already picked. That maximum is kept
+    per row and updated with one matrix-vector product per pick. With groups
+    and max_per_group, at most max_per_group rows of a group are picked.
+    """
+    available = np.ones(len(relevance), dtype=bool)
+    max_sim = np.zeros(len(relevance), dtype=np.float32)
+    group_counts = Counter()
+    selected = []
+    
+    while len(selected) < k and available.any():
+        mmr = np.where(available, lambda_ * relevance - (1 - lambda_) * max_sim, -np.inf)
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        
+        if max_per_group and groups is not None:
+            group_counts[groups[best]] += 1
+            if group_counts[groups[best]] >= max_per_group:
+                available &= groups != groups[best]
+        
+        if lambda_ < 1:
+            similarity = embeddings @ embeddings[best]
+            max_sim = similarity if len(selected) == 1 else np.maximum(max_sim, similarity)
+    
+    return selected
+
+def build_sections(chunks: List[dict], ranked: List[tuple], summaries: List[str]) -> List[DocumentSection]:
+    """Turn ranked (chunk index, score, stage) triples and their summaries into sections"""
+    return [
+        DocumentSection(
+            page=chunks[i]["page"],
+            rank=rank,
+            score=score,
+            text=chunks[i]["text"],
+            summary=summary,
+            title=chunks[i].get("title"),
+            page_end=chunks[i].get("page_end"),
+            stage=stage
+        )
+        for rank, ((i, score, stage), summary) in enumerate(zip(ranked, summaries), start=1)
+    ]
+
+def rerank(query_text: str, texts: List[str], budget_seconds: float) -> np.ndarray:
+    """Score texts against the query with the cross-encoder, batch by batch
+
+    Texts left when the latency budget runs out get NaN scores. The model
+    loads before the clock starts.
+    """
+    reranker = get_reranker()
+    scores = np.full(len(texts), np.nan, dtype=np.float32)
+    deadline = time.perf_counter() + budget_seconds
+    
+    for start in range(0, len(texts), RERANK_BATCH_SIZE):
+        if time.perf_counter() >= deadline:
+            logging.warning(f"Rerank budget exhausted after {start} of {len(texts)} candidates")
+            break
+        batch = texts[start:start + RERANK_BATCH_SIZE]
+        # ms-marco cross-encoders have one output, which predict passes through a sigmoid
+        scores[start:start + len(batch)] = reranker.predict(
+            [(query_text, text) for text in batch],
+            batch_size=len(batch),
+            show_progress_bar=False
+        )
+    
+    return scores
+
+async def rank_chunks(
+    chunks: List[dict],
+    chunk_embeddings: np.ndarray,
+    groups: np.ndarray,
+    scores: np.ndarray,
+    query_text: str,
+    query_embedding: np.ndarray,
+    top_k: int
+) -> List[DocumentSection]:
+    """Rank chunks by their first stage scores, reranking the best of them if enabled
+
+    Candidates are diversified first when MMR or a per-document cap is
+    configured, with groups giving the file of every chunk. Reranked
+    candidates come first, ordered by cross-encoder score, followed by any
+    the budget left unscored and then the rest in first stage order. Only
+    the final top_k chunks are summarized.
+    """
+    count = max(top_k, RERANK_TOP_N)
+    if MMR_LAMBDA < 1 or MAX_SECTIONS_PER_DOCUMENT:
+        candidates = top_k_indices(scores, max(count, MMR_CANDIDATES))
+        # Fused scores are rescaled to the range of the similarities they compete with
+        relevance = scores[candidates] if RANKING_MODE == 'dense' else min_max_normalize(scores[candidates])
+        picks = mmr_select(
+            chunk_embeddings[candidates],
+            relevance,
+            count,
+            MMR_LAMBDA,
+            groups[candidates],
+            MAX_SECTIONS_PER_DOCUMENT
+        )
+        order = candidates[picks]
+    else:
+        order = top_k_indices(scores, count)
+    ranked = [(i, float(scores[i]), "retrieval") for i in order]
+    
+    if RERANK_TOP_N and ranked:
+        head = ranked[:RERANK_TOP_N]
+        with timed("rerank"):
+            cross_scores = await embed_pool.run(
+                rerank,
+                query_text,
+                [chunks[i]["text"] for i, _, _ in head],
+                RERANK_BUDGET_MS / 1000
+            )
+        reranked = [(i, float(cross), "rerank") for (i, _, _), cross in zip(head, cross_scores) if not np.isnan(cross)]
+        reranked.sort(key=lambda x: x[1], reverse=True)
+        unscored = [candidate for candidate, cross in zip(head, cross_scores) if np.isnan(cross)]
+        ranked = reranked + unscored + ranked[RERANK_TOP_N:]
+    
+    ranked = ranked[:top_k]
+    with timed("summary"):
+        summaries = await summarize([chunks[i]["text"] for i, _, _ in ranked], query_embedding)
+    return build_sections(chunks, ranked, summaries)
+
+def build_query_text(persona: str, job: str) -> str:
+    return f"Persona: {persona}. Job: {job}."
+
+def normalize_query(text: str) -> str:
+    """Case and whitespace folded text; the models and BM25 lowercase their input"""
+    return " ".join(text.split()).lower()
+
+def query_model_id() -> str:
+    """Identifies the model persisted query embeddings were computed with"""
+    return f"{EMBEDDING_MODEL_NAME}:{EMBEDDING_BACKEND}"
+
+async def embed_queries(query_texts: List[str]) -> np.ndarray:
+    """Embed query texts, encoding only those in neither the query cache nor query_embeddings
+
+    Returns the embeddings in the order of query_texts. Newly encoded ones
+    are cached, and persisted with QUERY_CACHE_PERSIST.
+    """
+    keys = [normalize_query(text) for text in query_texts]
+    found = {key: query_cache.get(key) for key in keys}
+    missing = [key for key, embedding in found.items() if embedding is None]
+    QUERY_CACHE_LOOKUPS.labels("memory").inc(len(keys) - sum(key in missing for key in keys))
+    
+    if missing and QUERY_CACHE_PERSIST:
+        stored = db.query_embeddings.find({"model": query_model_id(), "key": {"$in": missing}})
+        async for document in stored:
+            found[document["key"]] = np.frombuffer(document["embedding"], dtype=np.float32)
+            query_cache.put(document["key"], found[document["key"]])
+        QUERY_CACHE_LOOKUPS.labels("stored").inc(sum(found[key] is not None for key in missing))
+        missing = [key for key in missing if found[key] is None]
+    
+    if missing:
+        texts = {key: text for key, text in zip(keys, query_texts)}
+        embeddings = await embed_pool.run(embed_texts, [texts[key] for key in missing])
+        QUERY_CACHE_LOOKUPS.labels("encoded").inc(len(missing))
+        for key, embedding in zip(missing, embeddings):
+            found[key] = embedding
+            query_cache.put(key, embedding)
+        
+        if QUERY_CACHE_PERSIST:
+            await db.query_embeddings.bulk_write([
+                UpdateOne(
+                    {"model": query_model_id(), "key": key},
+                    {"$set": {"embedding": embedding.tobytes(), "timestamp": datetime.utcnow()}},
+                    upsert=True
+                )
+                for key, embedding in zip(missing, embeddings)
+            ], ordered=False)
+    
+    return np.stack([found[key] for key in keys])
+
+async def warm_query_cache():
+    """Fill the query cache with persisted embeddings and the queries of recent analyses"""
+    if QUERY_CACHE_PERSIST:
+        stored = db.query_embeddings.find({"model": query_model_id()}).sort("timestamp", -1).limit(QUERY_CACHE_SIZE)
+        documents = await stored.to_list(QUERY_CACHE_SIZE)
+        for document in reversed(documents):  # Most recent last, as the LRU expects
+            query_cache.put(document["key"], np.frombuffer(document["embedding"], dtype=np.float32))
+    
+    recent = db.document_analyses.find(COMPLETED_ANALYSES, {"persona": 1, "job": 1}).sort(HISTORY_SORT).limit(QUERY_CACHE_WARM)
+    query_texts = list(dict.fromkeys([
+        build_query_text(analysis["persona"], analysis["job"]) async for analysis in recent
+    ]))
+    if query_texts:
+        await embed_queries(query_texts)
+    logging.info(f"Warmed the query cache with {len(query_cache.entries)} embeddings")
+
+def result_cache_key(persona: str, job: str, uploads: List[dict], top_k: int) -> str:
+    """Key of an analysis by its normalized query, file contents and pipeline settings"""
+    key = {
+        "persona": normalize_query(persona),
+        "job": normalize_query(job),
+        "files": sorted(upload["sha256"] for upload in uploads),
+        "top_k": top_k,
+        "pipeline": pipeline_config()
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+async def process_documents(
+    uploads: List[dict],
+    persona: str,
+    job: str,
+    top_k: int = DEFAULT_TOP_K,
+    progress=None,
+    save: bool = True,
+    cache_key: Optional[str] = None
+) -> DocumentAnalysisResult:
+    """Process uploaded documents and return analysis results
+
+    With a progress callback, file and page events are passed on as the
+    uploads are processed, together with a "topk" event holding the
+    provisional ranking after every embedded batch. The result is stored
+    in document_analyses unless save is False, and with a cache_key it is
+    also entered in the result cache.
+    """
+    
+    # Create query embedding
+    query_text = build_query_text(persona, job)
+    with timed("query_embed"):
+        query_embedding = (await embed_queries([query_text]))[0]
+    
+    leaders = []
+    
+    async def rank_progress(event: dict):
+        if event["event"] != "embedded":
+            await progress(event)
+            return
+        
+        # Merge the best chunks of this batch into the provisional top_k
+        batch_scores = event["embeddings"] @ query_embedding
+        for i in top_k_indices(batch_scores, top_k):
+            chunk = event["chunks"][i]
+            leaders.append({
+                "page": chunk["page"],
+                "score": float(batch_scores[i]),
+                "text": chunk["text"],
+                "title": chunk.get("title")
+            })
+        leaders.sort(key=lambda x: x["score"], reverse=True)
+        del leaders[top_k:]
+        await progress({
+            "event": "topk",
+            "results": [{"rank": rank, **leader} for rank, leader in enumerate(leaders, start=1)]
+        })
+    
+    file_chunks, file_embeddings = await embed_uploads(
+        uploads,
+        rank_progress if progress else None,
+        prefilter_query=query_text
+    )
+    
+    chunks = [chunk for chunks_of_file in file_chunks for chunk in chunks_of_file]
+    chunk_embeddings = np.concatenate(file_embeddings)
+    groups = np.repeat(np.arange(len(file_chunks)), [len(chunks_of_file) for chunks_of_file in file_chunks])
+    
+    # Score every chunk with one matrix product; embeddings are normalized,
+    # so the dot product is the cosine similarity
+    with timed("score"):
+        scores = chunk_embeddings @ query_embedding
+        if RANKING_MODE != 'dense':
+            lexical = await asyncio.to_thread(bm25_scores, [chunk["text"] for chunk in chunks], [query_text])
+            scores = fuse_scores(scores, lexical[0])
     
     # Create result
     result = DocumentAnalysisResult(
         persona=persona,
         job=job,
-        results=[DocumentSection(**section) for section in top_sections]
+        results=await rank_chunks(chunks, chunk_embeddings, groups, scores, query_text, query_embedding, top_k)
     )
     
     # Save to database
-    await db.document_analyses.insert_one(result.dict())
+    if save:
+        with timed("insert"):
+            document = result.dict()
+            if cache_key:
+                document["cache_key"] = cache_key
+            await db.document_analyses.insert_one(document)
+        if cache_key:
+            result_cache.put(cache_key, result)
+    
+    return result
+
+async def process_documents_batch(
+    uploads: List[dict],
+    requests: List[DocumentAnalysisRequest],
+    top_k: int = DEFAULT_TOP_K
+) -> List[DocumentAnalysisResult]:
+    """Analyze one document set for many persona/job pairs
+
+    Chunks are embedded once, all queries are encoded in one batch, and a
+    single query x chunk product scores every pair.
+    """
+    query_texts = [build_query_text(request.persona, request.job) for request in requests]
+    with timed("query_embed"):
+        query_embeddings = await embed_queries(query_texts)
+    
+    file_chunks, file_embeddings = await embed_uploads(uploads)
+    chunks = [chunk for chunks_of_file in file_chunks for chunk in chunks_of_file]
+    chunk_embeddings = np.concatenate(file_embeddings)
+    groups = np.repeat(np.arange(len(file_chunks)), [len(chunks_of_file) for chunks_of_file in file_chunks])
+    
+    with timed("score"):
+        score_matrix = query_embeddings @ chunk_embeddings.T
+        if RANKING_MODE != 'dense':
+            lexical = await asyncio.to_thread(bm25_scores, [chunk["text"] for chunk in chunks], query_texts)
+            score_matrix = fuse_scores(score_matrix, lexical)
+    
+    results = [
+        DocumentAnalysisResult(
+            persona=request.persona,
+            job=request.job,
+            results=await rank_chunks(chunks, chunk_embeddings, groups, scores, query_text, query_embedding, top_k)
+        )
+        for request, query_text, query_embedding, scores in zip(requests, query_texts, query_embeddings, score_matrix)
+    ]
+    
+    with timed("insert"):
+        await db.document_analyses.insert_many([result.dict() for result in results])
+    return results
+
+async def allocate_corpus_labels(count: int) -> List[int]:
+    """Reserve count consecutive corpus index labels, unique across server processes"""
+    counter = await db.counters.find_one_and_update(
+        {"_id": CORPUS_LABEL_COUNTER},
+        {"$inc": {"next": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return list(range(counter["next"] - count, counter["next"]))
+
+async def ingest_documents(uploads: List[dict]) -> List[CorpusDocument]:
+    """Add uploaded PDFs to the corpus index, skipping ones already registered"""
+    file_chunks, file_embeddings = await embed_uploads(uploads)
+    
+    documents = []
+    for upload, chunks, embeddings in zip(uploads, file_chunks, file_embeddings):
+        existing = await db.corpus_documents.find_one({"sha256": upload["sha256"]})
+        if existing:
+            documents.append(CorpusDocument(**existing))
+            continue
+        
+        document = CorpusDocument(filename=upload["filename"], sha256=upload["sha256"], chunks=len(chunks))
+        labels = await allocate_corpus_labels(len(chunks)) if chunks else []
+        await asyncio.to_thread(corpus_index.add, np.asarray(embeddings, dtype=np.float32), labels)
+        if labels:
+            await db.corpus_chunks.insert_many([
+                {
+                    "label": label,
+                    "document_id": document.id,
+                    "page": chunk["page"],
+                    "page_end": chunk.get("page_end"),
+                    "title": chunk.get("title"),
+                    "text": chunk["text"]
+                }
+                for label, chunk in zip(labels, chunks)
+            ])
+        await db.corpus_documents.insert_one(document.dict())
+        documents.append(document)
+    
+    return documents
+
+async def query_corpus(persona: str, job: str, top_k: int) -> DocumentAnalysisResult:
+    """Rank the chunks of the whole corpus against a persona and job"""
+    query_embedding = (await embed_queries([build_query_text(persona, job)]))[0]
+    
+    # hnswlib cannot return more neighbours than there are live elements;
+    # chunks are stored after they are indexed and deleted before they are
+    # removed, so their count never exceeds those
+    k = min(top_k, await db.corpus_chunks.estimated_document_count())
+    labels, scores = await asyncio.to_thread(corpus_index.search, query_embedding, k) if k else ([], [])
+    
+    chunks = {chunk["label"]: chunk async for chunk in db.corpus_chunks.find({"label": {"$in": labels}})}
+    document_ids = list({chunk["document_id"] for chunk in chunks.values()})
+    filenames = {
+        document["id"]: document["filename"]
+        async for document in db.corpus_documents.find({"id": {"$in": document_ids}})
+    }
+    
+    # Skip chunks removed while the query was running
+    found = [(chunks[label], float(score)) for label, score in zip(labels, scores) if label in chunks]
+    summaries = await summarize([chunk["text"] for chunk, _ in found], query_embedding)
+    
+    sections = [
+        DocumentSection(
+            page=chunk["page"],
+            rank=rank,
+            score=score,
+            text=chunk["text"],
+            summary=summary,
+            filename=filenames.get(chunk["document_id"]),
+            title=chunk.get("title"),
+            page_end=chunk.get("page_end"),
+            stage="retrieval"
+        )
+        for rank, ((chunk, score), summary) in enumerate(zip(found, summaries), start=1)
+    ]
     
+    result = DocumentAnalysisResult(persona=persona, job=job, results=sections)
+    await db.document_analyses.insert_one(result.dict())
     return result
 
+# Analysis jobs
+# Jobs are stored in document_analyses next to finished analyses; these are
+# the documents that hold a completed analysis
+COMPLETED_ANALYSES = {"status": {"$in": [None, "completed"]}}
+
+async def save_upload(file: UploadFile, path: Path) -> str:
+    """Stream an upload to path, returning the SHA-256 of its bytes"""
+    digest = hashlib.sha256()
+    async with aiofiles.open(path, 'wb') as f:
+        while True:
+            block = await file.read(UPLOAD_READ_BLOCK_BYTES)
+            if not block:
+                break
+            digest.update(block)
+            await f.write(block)
+    return digest.hexdigest()
+
+# Jobs whose files are on this host; jobs created before hosts were recorded have none
+LOCAL_JOBS = {"host": {"$in": [JOB_HOST, None]}}
+
+async def run_analysis_job(job_id: str, owner: str):
+    """Claim a queued job for the worker owner, process it and store its outcome on the job document"""
+    now = datetime.utcnow()
+    job_doc = await db.document_analyses.find_one_and_update(
+        {"id": job_id, "status": "queued", **LOCAL_JOBS},
+        {"$set": {"status": "running", "started_at": now, "owner": owner, "heartbeat": now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job_doc:  # Cancelled while queued, or claimed by another worker
+        if await db.document_analyses.find_one({"id": job_id, "status": "cancelled"}, {"_id": 1}):
+            # Cancelled through another host, which cannot remove the files
+            shutil.rmtree(JOBS_DIR / job_id, ignore_errors=True)
+        return
+    
+    uploads = [
+        {"filename": f["filename"], "sha256": f["sha256"], "source": f["path"]}
+        for f in job_doc["files"]
+    ]
+    
+    try:
+        async with profiling("job", should_profile()):
+            result = await process_documents(
+                uploads, job_doc["persona"], job_doc["job"], job_doc["top_k"], save=False
+            )
+    except asyncio.CancelledError:
+        # Cancelled by the user, requeued as stale, or interrupted by shutdown
+        # and resumed by another worker or on restart
+        job_doc = await db.document_analyses.find_one({"id": job_id}, {"status": 1})
+        if job_doc and job_doc["status"] == "cancelled":
+            shutil.rmtree(JOBS_DIR / job_id, ignore_errors=True)
+        raise
+    except Exception as e:
+        logging.error(f"Error processing job {job_id}: {str(e)}")
+        update = {"status": "failed", "error": "Error processing documents"}
+    else:
+        update = {"status": "completed", "results": [section.dict() for section in result.results]}
+    
+    update["finished_at"] = datetime.utcnow()
+    finished = await db.document_analyses.update_one(
+        {"id": job_id, "status": "running", "owner": owner},
+        {"$set": update}
+    )
+    if not finished.matched_count:
+        # Cancelled meanwhile, or requeued and now run by another worker
+        job_doc = await db.document_analyses.find_one({"id": job_id}, {"status": 1})
+        if not job_doc or job_doc["status"] != "cancelled":
+            return
+    shutil.rmtree(JOBS_DIR / job_id, ignore_errors=True)
+
+class JobQueue:
+    """Priority queue of analysis jobs served by a fixed number of in-process workers
+
+    The worker count bounds how many jobs run at once; lower priority values
+    are served first and equal priorities in submission order. Several server
+    processes on the host that stored a job may hold it: each claims it
+    atomically before running it, so only one does. Every process sends heartbeats for the jobs it runs,
+    stops those cancelled or requeued elsewhere, and requeues the jobs of
+    processes that stopped sending heartbeats.
+    """
+    
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.owner = None  # Identifies this process on the jobs it runs
+        self._queue = None
+        self._order = itertools.count()
+        self._tasks = []
+        self._known = set()  # Ids of the jobs queued or running here
+        self._running = {}  # Job id -> task processing it
+    
+    def start(self):
+        # Set after forking, as workers started with --preload share the module
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._watch()))
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        
+        # Hand the interrupted jobs over to the other workers right away
+        await db.document_analyses.update_many(
+            {"status": "running", "owner": self.owner},
+            {"$set": {"status": "queued"}, "$unset": {"owner": "", "heartbeat": ""}}
+        )
+    
+    async def recover(self):
+        """Requeue stale running jobs, then take on the queued jobs not yet held here"""
+        stale = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        await db.document_analyses.update_many(
+            {"status": "running", "$or": [{"heartbeat": {"$lt": stale}}, {"heartbeat": None}]},
+            {"$set": {"status": "queued"}, "$unset": {"owner": "", "heartbeat": ""}}
+        )
+        queued = db.document_analyses.find(
+            {"status": "queued", **LOCAL_JOBS}, {"id": 1, "priority": 1}
+        ).sort("timestamp", 1)
+        async for job_doc in queued:
+            if job_doc["id"] not in self._known:
+                self.submit(job_doc["id"], job_doc["priority"])
+    
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                running = list(self._running)
+                if running:
+                    await db.document_analyses.update_many(
+                        {"id": {"$in": running}, "status": "running", "owner": self.owner},
+                        {"$set": {"heartbeat": datetime.utcnow()}}
+                    )
+                    lost = db.document_analyses.find(
+                        {"id": {"$in": running}, "$or": [{"status": {"$ne": "running"}}, {"owner": {"$ne": self.owner}}]},
+                        {"id": 1}
+                    )
+                    async for job_doc in lost:
+                        self.cancel(job_doc["id"])
+                await self.recover()
+            except Exception as e:
+                logging.error(f"Error checking analysis jobs: {str(e)}")
+    
+    @property
+    def full(self) -> bool:
+        return self._queue.qsize() >= self.max_queued
+    
+    def submit(self, job_id: str, priority: str):
+        self._known.add(job_id)
+        self._queue.put_nowait((JOB_PRIORITIES[priority], next(self._order), job_id))
+    
+    def cancel(self, job_id: str):
+        """Stop a running job; queued jobs are skipped once their status is cancelled"""
+        task = self._running.get(job_id)
+        if task:
+            task.cancel()
+    
+    async def _work(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            task = asyncio.ensure_future(run_analysis_job(job_id, self.owner))
+            self._running[job_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+            except Exception as e:
+                logging.error(f"Job {job_id} crashed: {str(e)}")
+            finally:
+                del self._running[job_id]
+                self._known.discard(job_id)
+
+job_queue = JobQueue(JOB_WORKERS, JOB_MAX_QUEUED)
+
+# History pagination
+# Listings are sorted by (timestamp, id), newest first; a cursor encodes the
+# last entry of a page and the next page starts after it
+HISTORY_SORT = [("timestamp", -1), ("id", -1)]
+
+def encode_cursor(document: dict) -> str:
+    key = json.dumps([document["timestamp"].isoformat(), document["id"]])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def cursor_filter(cursor: Optional[str]) -> dict:
+    """Filter selecting the entries after the cursor, rejecting malformed cursors"""
+    if not cursor:
+        return {}
+    try:
+        timestamp, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        timestamp = datetime.fromisoformat(timestamp)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "id": {"$lt": entry_id}}
+    ]}
+
+async def find_page(collection, query: dict, projection: dict, limit: int) -> tuple:
+    """Fetch one page of a history listing, returning (documents, headers)
+
+    The headers hold X-Next-Cursor when a full page suggests more may follow.
+    """
+    documents = await collection.find(query, projection).sort(HISTORY_SORT).limit(limit).to_list(limit)
+    headers = {"X-Next-Cursor": encode_cursor(documents[-1])} if len(documents) == limit else {}
+    return documents, headers
+
 # API Routes
 @api_router.get("/")
 async def root():
     return {"message": "Document Intelligence API"}
 
+@api_router.get("/ready")
+async def readiness():
+    """Report whether the embedding model is loaded and requests can be served
+
+    If loading the models in the background failed, error says why.
+    """
+    status = {
+        "ready": (_embedder is not None or MODEL_PRELOAD == 'lazy') and model_load_error is None,
+        "model_loaded": _embedder is not None,
+        "backend": EMBEDDING_BACKEND,
+        "model_load_seconds": round(model_load_seconds, 2) if model_load_seconds is not None else None,
+        "error": model_load_error
+    }
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@api_router.get("/metrics")
+async def metrics():
+    """Expose pipeline metrics in the Prometheus text format"""
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Collected from the files of all worker processes on every scrape
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
@@ -215,19 +2451,18 @@ async def create_status_check(input: StatusCheckCreate):
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
+async def get_status_checks(
+    response: Response,
+    limit: int = Query(MAX_STATUS_PAGE_SIZE, ge=1, le=MAX_STATUS_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """Get status checks, newest first, one page at a time"""
+    status_checks, headers = await find_page(db.status_checks, cursor_filter(cursor), {"_id": 0}, limit)
+    response.headers.update(headers)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
-@api_router.post("/analyze", response_model=DocumentAnalysisResult)
-async def analyze_documents(
-    persona: str = Form(...),
-    job: str = Form(...),
-    files: List[UploadFile] = File(...)
-):
-    """Analyze uploaded documents for persona and job relevance"""
-    
-    # Validate inputs
+def validate_analysis_form(persona: str, job: str, files: List[UploadFile], top_k: int):
+    """Reject analysis requests with missing or invalid fields"""
     if not persona.strip() or not job.strip():
         raise HTTPException(status_code=400, detail="Persona and job are required")
     
@@ -237,35 +2472,366 @@ async def analyze_documents(
     if len(files) > 10:
         raise HTTPException(status_code=400, detail="Maximum 10 files allowed")
     
+    if not 1 <= top_k <= MAX_TOP_K:
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {MAX_TOP_K}")
+    
     # Validate file types
     for file in files:
         if not file.filename.lower().endswith('.pdf'):
             raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
+
+@api_router.post("/analyze", response_model=DocumentAnalysisResult)
+async def analyze_documents(
+    response: Response,
+    persona: str = Form(...),
+    job: str = Form(...),
+    files: List[UploadFile] = File(...),
+    top_k: int = Form(DEFAULT_TOP_K),
+    bypass_cache: bool = Form(False),
+    x_profile: Optional[str] = Header(None)
+):
+    """Analyze uploaded documents for persona and job relevance
+
+    Identical requests are answered from the result cache, reported in the
+    X-Cache header as HIT, MISS or BYPASS; bypass_cache forces a new
+    analysis, which then replaces the cached one.
+    """
+    validate_analysis_form(persona, job, files, top_k)
     
+    with analysis_admission.admit():
+        uploads = await read_uploads(files)
+        try:
+            cache_key = result_cache_key(persona, job, uploads, top_k)
+            if not bypass_cache:
+                cached = await result_cache.find(cache_key)
+                if cached:
+                    # The key folds case and whitespace, so echo this request's wording
+                    response.headers["X-Cache"] = "HIT"
+                    return cached.copy(update={"persona": persona, "job": job})
+            response.headers["X-Cache"] = "BYPASS" if bypass_cache else "MISS"
+            
+            async with profiling("analyze", should_profile(x_profile)) as profile:
+                result = await process_documents(uploads, persona, job, top_k, cache_key=cache_key)
+            if profile:
+                response.headers["X-Profile-Id"] = profile.name
+            return result
+        except Exception as e:
+            logging.error(f"Error processing documents: {str(e)}")
+            raise HTTPException(status_code=500, detail="Error processing documents")
+        finally:
+            release_uploads(uploads)
+
+@api_router.post("/analyze/batch", response_model=List[DocumentAnalysisResult])
+async def analyze_documents_batch(
+    response: Response,
+    requests: str = Form(...),
+    files: List[UploadFile] = File(...),
+    top_k: int = Form(DEFAULT_TOP_K),
+    x_profile: Optional[str] = Header(None)
+):
+    """Analyze uploaded documents for many persona/job pairs at once
+
+    requests is a JSON list of {"persona": ..., "job": ...} objects; one
+    DocumentAnalysisResult is returned per entry, in the same order.
+    """
     try:
-        result = await process_documents(files, persona, job)
-        return result
-    except Exception as e:
-        logging.error(f"Error processing documents: {str(e)}")
-        raise HTTPException(status_code=500, detail="Error processing documents")
+        analysis_requests = [DocumentAnalysisRequest(**item) for item in json.loads(requests)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="requests must be a JSON list of persona/job objects")
+    
+    if not analysis_requests:
+        raise HTTPException(status_code=400, detail="At least one persona/job pair is required")
+    
+    if len(analysis_requests) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Maximum {MAX_BATCH_QUERIES} persona/job pairs allowed")
+    
+    for request in analysis_requests:
+        validate_analysis_form(request.persona, request.job, files, top_k)
+    
+    with analysis_admission.admit():
+        uploads = await read_uploads(files)
+        try:
+            async with profiling("batch", should_profile(x_profile)) as profile:
+                results = await process_documents_batch(uploads, analysis_requests, top_k)
+            if profile:
+                response.headers["X-Profile-Id"] = profile.name
+            return results
+        except Exception as e:
+            logging.error(f"Error processing documents: {str(e)}")
+            raise HTTPException(status_code=500, detail="Error processing documents")
+        finally:
+            release_uploads(uploads)
 
-@api_router.get("/analyses", response_model=List[DocumentAnalysisResult])
-async def get_analyses():
-    """Get all document analyses"""
-    analyses = await db.document_analyses.find().sort("timestamp", -1).to_list(100)
-    return [DocumentAnalysisResult(**analysis) for analysis in analyses]
+@api_router.post("/analyze/stream")
+async def analyze_documents_stream(
+    persona: str = Form(...),
+    job: str = Form(...),
+    files: List[UploadFile] = File(...),
+    top_k: int = Form(DEFAULT_TOP_K),
+    x_profile: Optional[str] = Header(None)
+):
+    """Analyze uploaded documents, streaming progress as newline-delimited JSON
+
+    Emits "file" and "pages" events while documents are processed, "topk"
+    events with the provisional ranking, and finally a "result" event with the
+    DocumentAnalysisResult, or an "error" event. A "pages" event reports an
+    extracted page range of up to PROGRESS_PAGES_PER_TASK pages in text mode;
+    in layout mode a range is a whole file below PARALLEL_EXTRACT_MIN_PAGES.
+    """
+    validate_analysis_form(persona, job, files, top_k)
+    
+    # Uploads are read before streaming starts, while the request still owns
+    # them; the admission is held until the stream ends
+    analysis_admission.acquire()
+    try:
+        uploads = await read_uploads(files)
+    except BaseException:
+        analysis_admission.release()
+        raise
+    events = asyncio.Queue()
+    profile_requested = should_profile(x_profile)
+    
+    async def run():
+        try:
+            async with profiling("stream", profile_requested) as profile:
+                result = await process_documents(uploads, persona, job, top_k, events.put)
+            if profile:
+                await events.put({"event": "profile", "id": profile.name})
+            await events.put({"event": "result", "result": jsonable_encoder(result)})
+        except Exception as e:
+            logging.error(f"Error processing documents: {str(e)}")
+            await events.put({"event": "error", "status": 500, "detail": "Error processing documents"})
+        finally:
+            await events.put(None)
+    
+    async def stream():
+        task = asyncio.ensure_future(run())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield json.dumps(event) + "\n"
+        finally:
+            # Stops the analysis if the client goes away, and waits for it to
+            # unwind before its uploads and admission are given back
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+            finally:
+                release_uploads(uploads)
+                analysis_admission.release()
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@api_router.post("/jobs", response_model=AnalysisJob, status_code=202)
+async def create_analysis_job(
+    persona: str = Form(...),
+    job: str = Form(...),
+    files: List[UploadFile] = File(...),
+    top_k: int = Form(DEFAULT_TOP_K),
+    priority: Optional[str] = Form(None)
+):
+    """Queue an analysis to run in the background and return its job"""
+    validate_analysis_form(persona, job, files, top_k)
+    
+    if priority is not None and priority not in JOB_PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(JOB_PRIORITIES)}")
+    
+    if job_queue.full:
+        raise server_busy()
+    
+    analysis_job = AnalysisJob(persona=persona, job=job, top_k=top_k, filenames=[file.filename for file in files])
+    job_dir = JOBS_DIR / analysis_job.id
+    job_dir.mkdir(parents=True)
+    
+    stored_files = []
+    for i, file in enumerate(files):
+        path = job_dir / f"{i}.pdf"
+        stored_files.append({"filename": file.filename, "sha256": await save_upload(file, path), "path": str(path)})
+    
+    if priority is None:
+        total_bytes = sum(os.path.getsize(f["path"]) for f in stored_files)
+        priority = "low" if total_bytes > HEAVY_JOB_BYTES else "normal"
+    analysis_job.priority = priority
+    
+    await db.document_analyses.insert_one(
+        {**analysis_job.dict(), "results": [], "files": stored_files, "host": JOB_HOST}
+    )
+    job_queue.submit(analysis_job.id, priority)
+    return analysis_job
+
+@api_router.get("/jobs/{job_id}", response_model=AnalysisJob)
+async def get_analysis_job(job_id: str):
+    """Get the status of an analysis job"""
+    job_doc = await db.document_analyses.find_one({"id": job_id, "status": {"$ne": None}})
+    if not job_doc:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return AnalysisJob(**job_doc)
+
+@api_router.get("/jobs/{job_id}/result", response_model=DocumentAnalysisResult)
+async def get_analysis_job_result(job_id: str):
+    """Get the result of a completed analysis job"""
+    job_doc = await db.document_analyses.find_one({"id": job_id, "status": {"$ne": None}})
+    if not job_doc:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job_doc["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job_doc['status']}")
+    return DocumentAnalysisResult(**job_doc)
+
+@api_router.delete("/jobs/{job_id}", response_model=AnalysisJob)
+async def cancel_analysis_job(job_id: str):
+    """Cancel a queued or running analysis job"""
+    job_doc = await db.document_analyses.find_one_and_update(
+        {"id": job_id, "status": {"$in": ["queued", "running"]}},
+        {"$set": {"status": "cancelled", "finished_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job_doc:
+        existing = await db.document_analyses.find_one({"id": job_id, "status": {"$ne": None}})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail=f"Job is already {existing['status']}")
+    
+    job_queue.cancel(job_id)
+    # A running job's worker cleans up, as does the host of a job queued elsewhere
+    if job_doc.get("owner") is None and job_doc.get("host", JOB_HOST) == JOB_HOST:
+        shutil.rmtree(JOBS_DIR / job_id, ignore_errors=True)
+    return AnalysisJob(**job_doc)
+
+# Fields of analyses in listings; the 'list' view leaves out section texts
+ANALYSIS_FIELDS = {"_id": 0, "id": 1, "persona": 1, "job": 1, "timestamp": 1}
+FULL_ANALYSIS_PROJECTION = {**ANALYSIS_FIELDS, "results": 1}
+LIST_ANALYSIS_PROJECTION = {
+    **ANALYSIS_FIELDS,
+    **{f"results.{field}": 1 for field in DocumentSection.__fields__ if field != "text"}
+}
+
+@api_router.get("/analyses")
+async def get_analyses(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_ANALYSES_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    persona: Optional[str] = None,
+    job: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|list)$")
+):
+    """Get document analyses, newest first, one page at a time
+
+    Pass the X-Next-Cursor header of a page as cursor to get the next one.
+    persona and job filter on exact values; view=list leaves out the
+    section texts. Documents are returned as stored, without revalidation.
+    """
+    query = {**COMPLETED_ANALYSES, **cursor_filter(cursor)}
+    if persona is not None:
+        query["persona"] = persona
+    if job is not None:
+        query["job"] = job
+    
+    projection = LIST_ANALYSIS_PROJECTION if view == "list" else FULL_ANALYSIS_PROJECTION
+    analyses, headers = await find_page(db.document_analyses, query, projection, limit)
+    return JSONResponse(content=jsonable_encoder(analyses), headers=headers)
 
 @api_router.get("/analyses/{analysis_id}", response_model=DocumentAnalysisResult)
 async def get_analysis(analysis_id: str):
     """Get specific document analysis"""
-    analysis = await db.document_analyses.find_one({"id": analysis_id})
+    analysis = await db.document_analyses.find_one({"id": analysis_id, **COMPLETED_ANALYSES})
     if not analysis:
         raise HTTPException(status_code=404, detail="Analysis not found")
     return DocumentAnalysisResult(**analysis)
 
+@api_router.get("/profiles")
+async def get_profiles(x_profile: Optional[str] = Header(None)):
+    """List stored analysis profiles, newest first"""
+    if not is_profile_admin(x_profile):
+        raise HTTPException(status_code=403, detail="A valid X-Profile admin token is required")
+    
+    paths = sorted(PROFILE_DIR.glob('*.prof'), key=lambda path: path.stat().st_mtime, reverse=True)
+    return [
+        {"id": path.name, "bytes": path.stat().st_size, "created": datetime.utcfromtimestamp(path.stat().st_mtime)}
+        for path in paths
+    ]
+
+@api_router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_profile: Optional[str] = Header(None)):
+    """Download a stored profile in pstats format"""
+    if not is_profile_admin(x_profile):
+        raise HTTPException(status_code=403, detail="A valid X-Profile admin token is required")
+    
+    path = PROFILE_DIR / profile_id
+    if not PROFILE_NAME_PATTERN.fullmatch(profile_id) or not path.is_file():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=profile_id)
+
+@api_router.post("/corpus/documents", response_model=List[CorpusDocument])
+async def add_corpus_documents(files: List[UploadFile] = File(...)):
+    """Register PDFs in the persistent corpus"""
+    for file in files:
+        if not file.filename.lower().endswith('.pdf'):
+            raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
+    
+    with analysis_admission.admit():
+        uploads = await read_uploads(files)
+        try:
+            return await ingest_documents(uploads)
+        except Exception as e:
+            logging.error(f"Error ingesting documents: {str(e)}")
+            raise HTTPException(status_code=500, detail="Error ingesting documents")
+        finally:
+            release_uploads(uploads)
+
+@api_router.get("/corpus/documents", response_model=List[CorpusDocument])
+async def get_corpus_documents():
+    """List the documents registered in the corpus"""
+    documents = await db.corpus_documents.find().sort("timestamp", -1).to_list(1000)
+    return [CorpusDocument(**document) for document in documents]
+
+@api_router.delete("/corpus/documents/{document_id}")
+async def delete_corpus_document(document_id: str):
+    """Remove a document and its chunks from the corpus"""
+    document = await db.corpus_documents.find_one({"id": document_id})
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    labels = [chunk["label"] async for chunk in db.corpus_chunks.find({"document_id": document_id}, {"label": 1})]
+    await db.corpus_chunks.delete_many({"document_id": document_id})
+    await asyncio.to_thread(corpus_index.remove, labels)
+    await db.corpus_documents.delete_one({"id": document_id})
+    return {"message": "Document removed", "id": document_id}
+
+@api_router.post("/corpus/query", response_model=DocumentAnalysisResult)
+async def query_corpus_documents(query: CorpusQuery):
+    """Rank the registered corpus for a persona and job"""
+    if not query.persona.strip() or not query.job.strip():
+        raise HTTPException(status_code=400, detail="Persona and job are required")
+    
+    with analysis_admission.admit():
+        return await query_corpus(query.persona, query.job, query.top_k)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+async def add_server_timing(request, call_next):
+    """Report the stage timings of a request in a Server-Timing header"""
+    timings = {}
+    token = stage_timings.set(timings)
+    try:
+        response = await call_next(request)
+    finally:
+        stage_timings.reset(token)
+    
+    # Streamed responses only report the stages run before their headers are sent
+    if timings:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+        )
+    return response
+
+# Only installed when enabled, as HTTP middleware wraps every response
+if SERVER_TIMING:
+    app.middleware("http")(add_server_timing)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -281,6 +2847,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+logger.info(f"Imported server module in {time.perf_counter() - IMPORT_STARTED:.2f}s")
+if MODEL_PRELOAD == 'import':
+    load_models()
+
+@app.on_event("startup")
+async def preload_model():
+    if MODEL_PRELOAD == 'startup':
+        # Load in the background so health checks answer while the weights load
+        app.state.model_loader = asyncio.ensure_future(asyncio.to_thread(load_models))
+        app.state.model_loader.add_done_callback(report_model_load)
+
+@app.on_event("startup")
+async def create_corpus_indexes():
+    await db.corpus_chunks.create_index("label", unique=True)
+    await db.corpus_chunks.create_index("document_id")
+    await db.corpus_documents.create_index("sha256")
+    
+    # Start label allocation after the labels of corpora indexed before the counter existed
+    last = await db.corpus_chunks.find_one({}, {"label": 1}, sort=[("label", -1)])
+    if last:
+        await db.counters.update_one(
+            {"_id": CORPUS_LABEL_COUNTER},
+            {"$max": {"next": last["label"] + 1}},
+            upsert=True
+        )
+
+@app.on_event("startup")
+async def create_history_indexes():
+    await db.document_analyses.create_index("id")
+    await db.document_analyses.create_index(HISTORY_SORT)
+    await db.document_analyses.create_index([("persona", 1), *HISTORY_SORT])
+    await db.document_analyses.create_index([("job", 1), *HISTORY_SORT])
+    await db.document_analyses.create_index([("cache_key", 1), ("timestamp", -1)], sparse=True)
+    await db.status_checks.create_index(HISTORY_SORT)
+
+@app.on_event("startup")
+async def create_query_cache_indexes():
+    if QUERY_CACHE_PERSIST:
+        await db.query_embeddings.create_index([("model", 1), ("key", 1)], unique=True)
+        await db.query_embeddings.create_index([("model", 1), ("timestamp", -1)])
+
+@app.on_event("startup")
+async def start_query_cache_warmer():
+    # Lazy loading defers the model until a request needs it, so skip warming
+    if QUERY_CACHE_WARM <= 0 or MODEL_PRELOAD == 'lazy':
+        return
+    
+    async def warm():
+        try:
+            await warm_query_cache()
+        except Exception as e:
+            logging.error(f"Error warming the query cache: {str(e)}")
+    
+    app.state.query_cache_warmer = asyncio.ensure_future(warm())
+
+@app.on_event("startup")
+async def start_job_queue():
+    await db.document_analyses.create_index([("status", 1), ("heartbeat", 1)])
+    job_queue.start()
+    
+    # Resume jobs that are queued, or whose worker went away without finishing them
+    await job_queue.recover()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    await job_queue.stop()
+
+@app.on_event("shutdown")
+async def stop_query_cache_warmer():
+    warmer = getattr(app.state, "query_cache_warmer", None)
+    if warmer:
+        warmer.cancel()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+
+@app.on_event("shutdown")
+async def shutdown_worker_pools():
+    extract_pool.shutdown()
+    embed_pool.shutdown()
@@ -506,6 +506,269 @@ class DocumentIntelligenceTest:
             self.log_test("Multi-file Limit Validation", False, f"Error: {str(e)}")
             return False
 
+    def test_batch_analysis(self):
+        """Test analyzing one document set for several persona/job pairs"""
+        try:
+            pdf_path = self.create_test_pdf("""
+            Batch Analysis Test Document
+            
+            Code reviews and automated tests keep software maintainable.
+            Fresh ingredients and careful timing make better meals.
+            """, "batch_test.pdf")
+            
+            requests_json = json.dumps([
+                {'persona': 'Senior Software Engineer', 'job': 'Improve code quality'},
+                {'persona': 'Home Cook', 'job': 'Prepare a better meal'},
+            ])
+            files = [('files', ('batch_test.pdf', open(pdf_path, 'rb'), 'application/pdf'))]
+            
+            response = self.session.post(f"{API_URL}/analyze/batch", files=files, data={'requests': requests_json})
+            files[0][1][1].close()
+            os.unlink(pdf_path)
+            
+            if response.status_code != 200:
+                self.log_test("Batch Analysis", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            
+            results = response.json()
+            if len(results) != 2 or [r['persona'] for r in results] != ['Senior Software Engineer', 'Home Cook']:
+                self.log_test("Batch Analysis", False, "Expected one result per persona/job pair, in order")
+                return False
+            
+            self.log_test("Batch Analysis", True, f"Received {len(results)} analyses from one upload")
+            return True
+            
+        except Exception as e:
+            self.log_test("Batch Analysis", False, f"Error: {str(e)}")
+            return False
+
+    def test_streaming_analysis(self):
+        """Test the NDJSON streaming variant of document analysis"""
+        try:
+            pdf_path = self.create_test_pdf("""
+            Streaming Analysis Test Document
+            
+            Progress events are sent while each file and page is processed.
+            Provisional rankings arrive before the final analysis result.
+            """, "stream_test.pdf")
+            
+            files = [('files', ('stream_test.pdf', open(pdf_path, 'rb'), 'application/pdf'))]
+            data = {'persona': 'Test Engineer', 'job': 'Testing streamed progress events'}
+            
+            response = self.session.post(f"{API_URL}/analyze/stream", files=files, data=data, stream=True)
+            events = [json.loads(line) for line in response.iter_lines() if line]
+            
+            files[0][1][1].close()
+            os.unlink(pdf_path)
+            
+            if response.status_code != 200:
+                self.log_test("Streaming Analysis", False, f"HTTP {response.status_code}")
+                return False
+            
+            kinds = [event['event'] for event in events]
+            if not kinds or kinds[-1] != 'result' or 'file' not in kinds:
+                self.log_test("Streaming Analysis", False, f"Unexpected event sequence: {kinds}")
+                return False
+            
+            self.log_test("Streaming Analysis", True, 
+                        f"Received {len(events)} events ending with {len(events[-1]['result']['results'])} ranked results")
+            return True
+            
+        except Exception as e:
+            self.log_test("Streaming Analysis", False, f"Error: {str(e)}")
+            return False
+
+    def test_analysis_jobs(self):
+        """Test queued analysis jobs with status polling"""
+        try:
+            pdf_path = self.create_test_pdf("""
+            Background Job Test Document
+            
+            Long analyses run as queued jobs outside of the HTTP request.
+            Clients poll the job status and fetch the result when it is completed.
+            """, "job_test.pdf")
+            
+            files = [('files', ('job_test.pdf', open(pdf_path, 'rb'), 'application/pdf'))]
+            data = {'persona': 'Test Engineer', 'job': 'Testing background analysis jobs'}
+            
+            response = self.session.post(f"{API_URL}/jobs", files=files, data=data)
+            files[0][1][1].close()
+            os.unlink(pdf_path)
+            
+            if response.status_code != 202:
+                self.log_test("Analysis Job Creation", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            job_id = response.json()['id']
+            self.log_test("Analysis Job Creation", True, f"Queued job {job_id}")
+            
+            status = None
+            for _ in range(60):
+                status = self.session.get(f"{API_URL}/jobs/{job_id}").json()['status']
+                if status not in ('queued', 'running'):
+                    break
+                time.sleep(1)
+            
+            if status != 'completed':
+                self.log_test("Analysis Job Completion", False, f"Job ended as {status}")
+                return False
+            
+            response = self.session.get(f"{API_URL}/jobs/{job_id}/result")
+            if response.status_code != 200 or not response.json()['results']:
+                self.log_test("Analysis Job Completion", False, f"HTTP {response.status_code}")
+                return False
+            
+            self.log_test("Analysis Job Completion", True, 
+                        f"Job completed with {len(response.json()['results'])} results")
+            return True
+            
+        except Exception as e:
+            self.log_test("Analysis Jobs", False, f"Error: {str(e)}")
+            return False
+
+    def test_corpus_index(self):
+        """Test corpus ingestion, ANN query and removal"""
+        try:
+            pdf_path = self.create_test_pdf("""
+            Corpus Indexing Test Document
+            
+            Vector indexes answer nearest neighbour queries over stored chunk embeddings.
+            Registered documents can be queried many times without being uploaded again.
+            """, "corpus_test.pdf")
+            
+            files = [('files', ('corpus_test.pdf', open(pdf_path, 'rb'), 'application/pdf'))]
+            response = self.session.post(f"{API_URL}/corpus/documents", files=files)
+            files[0][1][1].close()
+            os.unlink(pdf_path)
+            
+            if response.status_code != 200:
+                self.log_test("Corpus Ingestion", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            document = response.json()[0]
+            self.log_test("Corpus Ingestion", True, f"Registered document with {document['chunks']} chunks")
+            
+            query = {'persona': 'Search Engineer', 'job': 'Querying stored documents', 'top_k': 5}
+            response = self.session.post(f"{API_URL}/corpus/query", json=query)
+            if response.status_code != 200:
+                self.log_test("Corpus Query", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            results = response.json()['results']
+            if not results or len(results) > 5:
+                self.log_test("Corpus Query", False, f"Unexpected number of results: {len(results)}")
+                return False
+            self.log_test("Corpus Query", True, f"Retrieved {len(results)} sections from the corpus")
+            
+            response = self.session.delete(f"{API_URL}/corpus/documents/{document['id']}")
+            if response.status_code != 200:
+                self.log_test("Corpus Removal", False, f"HTTP {response.status_code}")
+                return False
+            self.log_test("Corpus Removal", True, "Document removed from the corpus")
+            return True
+            
+        except Exception as e:
+            self.log_test("Corpus Index", False, f"Error: {str(e)}")
+            return False
+
+    def test_metrics(self):
+        """Test that pipeline metrics are exposed for Prometheus"""
+        try:
+            response = self.session.get(f"{API_URL}/metrics")
+            if response.status_code != 200:
+                self.log_test("Metrics", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            
+            missing = [name for name in ('analysis_stage_seconds', 'chunks_embedded_total', 'worker_pool_pending_tasks')
+                       if name not in response.text]
+            if missing:
+                self.log_test("Metrics", False, f"Missing metrics: {', '.join(missing)}")
+                return False
+            
+            self.log_test("Metrics", True, "Stage, throughput and pool metrics are exposed")
+            return True
+            
+        except Exception as e:
+            self.log_test("Metrics", False, f"Error: {str(e)}")
+            return False
+
+    def test_profile_access(self):
+        """Test that stored profiles are only served to admins"""
+        try:
+            response = self.session.get(f"{API_URL}/profiles", headers={'X-Profile': 'not-the-admin-token'})
+            if response.status_code != 403:
+                self.log_test("Profile Access", False, f"Expected HTTP 403, got {response.status_code}")
+                return False
+            
+            self.log_test("Profile Access", True, "Profiles are hidden without the admin token")
+            return True
+            
+        except Exception as e:
+            self.log_test("Profile Access", False, f"Error: {str(e)}")
+            return False
+
+    def test_history_pagination(self):
+        """Test paginated, projected analysis history"""
+        try:
+            response = self.session.get(f"{API_URL}/analyses", params={'limit': 1, 'view': 'list'})
+            if response.status_code != 200:
+                self.log_test("History Pagination", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            
+            analyses = response.json()
+            if len(analyses) > 1 or any('text' in section for a in analyses for section in a['results']):
+                self.log_test("History Pagination", False, "Expected at most one analysis without section texts")
+                return False
+            
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor:
+                next_page = self.session.get(f"{API_URL}/analyses", params={'limit': 1, 'cursor': cursor}).json()
+                if next_page and next_page[0]['id'] == analyses[0]['id']:
+                    self.log_test("History Pagination", False, "Next page repeats the previous one")
+                    return False
+            
+            self.log_test("History Pagination", True, f"Listed {len(analyses)} analysis, next cursor {'set' if cursor else 'absent'}")
+            return True
+            
+        except Exception as e:
+            self.log_test("History Pagination", False, f"Error: {str(e)}")
+            return False
+
+    def test_result_cache(self):
+        """Test that identical analysis requests are answered from the result cache"""
+        try:
+            pdf_path = self.create_test_pdf("""
+            Result Cache Test Document
+            
+            Repeated dashboard requests should not analyze the same files twice.
+            Code reviews and automated tests keep software maintainable.
+            """, "cache_test.pdf")
+            with open(pdf_path, 'rb') as f:
+                pdf_bytes = f.read()
+            os.unlink(pdf_path)
+            
+            def analyze(**extra):
+                files = [('files', ('cache_test.pdf', pdf_bytes, 'application/pdf'))]
+                data = {'persona': 'Senior Software Engineer', 'job': 'Improve code quality', **extra}
+                return self.session.post(f"{API_URL}/analyze", files=files, data=data)
+            
+            first, second, bypassed = analyze(), analyze(), analyze(bypass_cache='true')
+            if any(r.status_code != 200 for r in (first, second, bypassed)):
+                self.log_test("Result Cache", False, "Analysis request failed")
+                return False
+            
+            if second.headers.get('X-Cache') != 'HIT' or second.json()['id'] != first.json()['id']:
+                self.log_test("Result Cache", False, f"Expected a cache hit, got {second.headers.get('X-Cache')}")
+                return False
+            
+            if bypassed.headers.get('X-Cache') != 'BYPASS':
+                self.log_test("Result Cache", False, f"Expected a bypass, got {bypassed.headers.get('X-Cache')}")
+                return False
+            
+            self.log_test("Result Cache", True, "Repeated request served from the cache, bypass honored")
+            return True
+            
+        except Exception as e:
+            self.log_test("Result Cache", False, f"Error: {str(e)}")
+            return False
+
     def run_all_tests(self):
         """Run all tests in sequence"""
         print("=" * 60)
@@ -522,6 +785,14 @@ class DocumentIntelligenceTest:
             ("File Validation", self.test_file_validation),
             ("Multi-file Limits", self.test_multi_file_limits),
             ("Results Storage and Retrieval", self.test_results_storage_and_retrieval),
+            ("History Pagination", self.test_history_pagination),
+            ("Result Cache", self.test_result_cache),
+            ("Batch Analysis", self.test_batch_analysis),
+            ("Streaming Analysis", self.test_streaming_analysis),
+            ("Analysis Jobs", self.test_analysis_jobs),
+            ("Corpus Index", self.test_corpus_index),
+            ("Metrics", self.test_metrics),
+            ("Profile Access", self.test_profile_access),
         ]
         
         passed = 0
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Benchmark the document analysis pipeline on synthetic PDF corpora
+
+Generates corpora of reportlab PDFs for every combination of file count,
+pages per file and lines per page, then times each pipeline stage in-process
+against a mocked database: text extraction, chunking, embedding, scoring,
+summarization and the analysis insert, plus process_documents end to end.
+Results are written as JSON; pass a previous run with --baseline to flag
+stages that got slower.
+
+Usage: python benchmark.py [--files 1,4] [--pages 10,100] [--density 40]
+                           [--repeat 3] [--output results.json]
+                           [--baseline previous.json] [--tolerance 0.2]
+                           [--min-delta-ms 5]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import bson
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+# Keep benchmark runs out of the real embedding cache
+os.environ.setdefault("EMBEDDING_CACHE_DIR", tempfile.mkdtemp(prefix="benchmark_cache_"))
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+import server  # noqa: E402
+
+PERSONA = "Data Scientist"
+JOB = "Evaluate and validate machine learning models"
+
+WORDS = (
+    "model data training validation accuracy feature pipeline deployment review code test quality "
+    "recipe dinner kitchen flavor sauce protein experiment sample microscopy gene expression analysis "
+    "report budget policy employee travel approval system network latency storage cluster query index"
+).split()
+
+STAGES = ["extract", "chunk", "embed", "score", "summary", "insert", "end_to_end"]
+
+
+class FakeCollection:
+    """In-memory stand-in for a motor collection that BSON-encodes what it stores"""
+
+    def __init__(self):
+        self.documents = []
+
+    async def insert_one(self, document):
+        self.documents.append(bson.encode(document))
+
+    async def insert_many(self, documents):
+        self.documents.extend(bson.encode(document) for document in documents)
+
+
+class FakeDatabase:
+    def __getattr__(self, name):
+        collection = FakeCollection()
+        setattr(self, name, collection)
+        return collection
+
+
+def create_corpus(directory, files, pages, lines_per_page, seed=0):
+    """Write files PDFs of pages pages with lines_per_page lines of random words each"""
+    rng = random.Random(seed)
+    width, height = letter
+    paths = []
+
+    for f in range(files):
+        path = os.path.join(directory, f"corpus_{f}.pdf")
+        c = canvas.Canvas(path, pagesize=letter)
+        for _ in range(pages):
+            c.setFont("Helvetica", 10)
+            y_position = height - 50
+            for _ in range(lines_per_page):
+                words = rng.choices(WORDS, k=12)
+                c.drawString(50, y_position, " ".join(words).capitalize() + ".")
+                y_position -= (height - 100) / lines_per_page
+            c.showPage()
+        c.save()
+        paths.append(path)
+
+    return paths
+
+
+def measure(fn, repeat):
+    """Run fn repeat times, returning its last result and the timings in seconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, {"median": statistics.median(timings), "min": min(timings)}
+
+
+def benchmark_corpus(paths, repeat, loop):
+    """Time every stage of the pipeline on one corpus, running coroutines on loop"""
+    stages = {}
+    query_text = server.build_query_text(PERSONA, JOB)
+    max_tokens = server.CHUNK_MAX_TOKENS if server.CHUNK_MODE == "tokens" else None
+
+    pages, stages["extract"] = measure(
+        lambda: [page for path in paths for page in server.extract_text_from_pdf(path)],
+        repeat
+    )
+
+    def chunk():
+        return [
+            page["text"][start:end]
+            for page in pages
+            for start, end, _ in server.chunk_spans(
+                page["text"], server.CHUNK_MAX_LENGTH, max_tokens, server.CHUNK_OVERLAP
+            )
+            if end - start >= server.MIN_CHUNK_LENGTH
+        ]
+
+    texts, stages["chunk"] = measure(chunk, repeat)
+
+    embedder = server.get_embedder()
+    query_embedding = server.embed_texts([query_text], embedder=embedder)[0]
+    embeddings, stages["embed"] = measure(lambda: server.embed_texts(texts, embedder=embedder), repeat)
+
+    top, stages["score"] = measure(
+        lambda: server.top_k_indices(embeddings @ query_embedding, server.DEFAULT_TOP_K),
+        repeat
+    )
+
+    if server.SUMMARY_MODE == "query":
+        summarize = lambda: server.query_summaries([texts[i] for i in top], query_embedding)  # noqa: E731
+    else:
+        summarize = lambda: [server.generate_summary(texts[i]) for i in top]  # noqa: E731
+    _, stages["summary"] = measure(summarize, repeat)
+
+    # The analysis document as process_documents stores it
+    result = server.DocumentAnalysisResult(persona=PERSONA, job=JOB, results=[
+        server.DocumentSection(page=1, rank=rank, score=0.0, text=texts[i], summary=texts[i][:200])
+        for rank, i in enumerate(top, start=1)
+    ])
+    collection = FakeCollection()
+    _, stages["insert"] = measure(lambda: loop.run_until_complete(collection.insert_one(result.dict())), repeat)
+
+    # The whole pipeline, with worker pools; unique hashes keep the embedding cache cold
+    sources = [Path(path).read_bytes() for path in paths]
+    runs = iter(range(repeat))
+
+    def end_to_end():
+        run = next(runs)
+        uploads = [
+            {
+                "filename": os.path.basename(path),
+                "sha256": hashlib.sha256(source + f"{time.time()}:{run}".encode()).hexdigest(),
+                "source": source
+            }
+            for path, source in zip(paths, sources)
+        ]
+        return loop.run_until_complete(server.process_documents(uploads, PERSONA, JOB))
+
+    _, stages["end_to_end"] = measure(end_to_end, repeat)
+
+    return {"pages": len(pages), "chunks": len(texts), "stages": stages}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def corpus_key(corpus):
+    return (corpus["files"], corpus["pages_per_file"], corpus["lines_per_page"])
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """Print each stage against the baseline, returning the stages that regressed
+
+    A stage regresses when its median grew by more than tolerance and by
+    more than min_delta seconds, so timer noise on tiny stages is ignored.
+    """
+    previous = {corpus_key(run["corpus"]): run for run in baseline["runs"]}
+    regressions = []
+
+    for run in results["runs"]:
+        old = previous.get(corpus_key(run["corpus"]))
+        if old is None:
+            continue
+        print(f"\nCorpus {run['corpus']} vs {baseline.get('commit') or 'baseline'}:")
+        for stage in STAGES:
+            if stage not in run["stages"] or stage not in old["stages"]:
+                continue
+            now, before = run["stages"][stage]["median"], old["stages"][stage]["median"]
+            change = now / before - 1 if before else 0.0
+            regressed = change > tolerance and now - before > min_delta
+            if regressed:
+                regressions.append((run["corpus"], stage, change))
+            status = "❌" if regressed else "✅"
+            print(f"   {status} {stage:<11} {before * 1000:9.1f} ms -> {now * 1000:9.1f} ms ({change:+.0%})")
+
+    return regressions
+
+
+def parse_counts(value):
+    return [int(count) for count in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--files", type=parse_counts, default=[1, 4], help="Files per corpus, comma separated")
+    parser.add_argument("--pages", type=parse_counts, default=[10, 100], help="Pages per file, comma separated")
+    parser.add_argument("--density", type=parse_counts, default=[40], help="Lines per page, comma separated")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage; the median is compared")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown per stage, as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Slowdowns below this are never regressions")
+    args = parser.parse_args()
+
+    server.db = FakeDatabase()
+    loop = asyncio.new_event_loop()
+    started = time.perf_counter()
+    server.get_embedder()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "model_load_seconds": time.perf_counter() - started,
+        "settings": {
+            "model": server.EMBEDDING_MODEL_NAME,
+            "backend": server.EMBEDDING_BACKEND,
+            "embed_batch_size": server.EMBED_BATCH_SIZE,
+            "ranking": server.RANKING_MODE,
+            "summary": server.SUMMARY_MODE,
+            **server.chunking_params()
+        },
+        "runs": []
+    }
+
+    try:
+        for files in args.files:
+            for pages in args.pages:
+                for lines in args.density:
+                    corpus = {"files": files, "pages_per_file": pages, "lines_per_page": lines}
+                    with tempfile.TemporaryDirectory() as directory:
+                        paths = create_corpus(directory, files, pages, lines)
+                        run = benchmark_corpus(paths, args.repeat, loop)
+                    results["runs"].append({"corpus": corpus, **run})
+                    timings = ", ".join(f"{stage} {t['median'] * 1000:.0f} ms" for stage, t in run["stages"].items())
+                    print(f"{corpus}: {run['pages']} pages, {run['chunks']} chunks; {timings}", file=sys.stderr)
+    finally:
+        server.extract_pool.shutdown()
+        server.embed_pool.shutdown()
+        loop.close()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms / 1000)
+        if regressions:
+            print(f"\n⚠️  {len(regressions)} stage(s) slower than the baseline by more than {args.tolerance:.0%}")
+            return False
+        print("\n🎉 No stage regressed beyond the tolerance.")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
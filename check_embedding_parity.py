@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Check that an alternative embedding backend ranks documents like the PyTorch one
+
+Runs the sample PDFs written by create_test_pdfs.py through extraction and
+chunking, ranks the chunks for a set of persona/job queries with the reference
+('torch') and candidate backends, and compares the top-k rankings.
+
+Usage: python check_embedding_parity.py [candidate_backend] [pdf_dir]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+import server  # noqa: E402
+
+QUERIES = [
+    ("Senior Software Engineer", "Improve code quality and review practices"),
+    ("Data Scientist", "Evaluate and validate machine learning models"),
+    ("Home Cook", "Prepare a traditional dinner recipe"),
+    ("Business Analyst", "Plan a data science project from collection to deployment"),
+    ("Lab Researcher", "Choose gene expression and microscopy methods"),
+]
+
+TOP_K = 10
+MIN_OVERLAP = 0.8  # Fraction of the reference top-k the candidate must also return
+MAX_RANK_SHIFT = 3  # Largest allowed rank change for a shared top-k chunk
+
+
+def embed_all(embedder, texts):
+    """Embed texts with the given backend through the normal batching path"""
+    started = time.perf_counter()
+    embeddings = server.embed_texts(texts, embedder=embedder)
+    return embeddings, time.perf_counter() - started
+
+
+def main():
+    candidate = sys.argv[1] if len(sys.argv) > 1 else "onnx-int8"
+    pdf_dir = Path(sys.argv[2] if len(sys.argv) > 2 else "/app/test_pdfs")
+
+    pdf_paths = sorted(pdf_dir.glob("*.pdf"))
+    if not pdf_paths:
+        print(f"No PDFs found in {pdf_dir}, run create_test_pdfs.py first")
+        return False
+
+    chunks = [chunk for path in pdf_paths for chunk in server.extract_chunks(str(path))]
+    texts = [chunk["text"] for chunk in chunks]
+    queries = [server.build_query_text(persona, job) for persona, job in QUERIES]
+    print(f"Corpus: {len(pdf_paths)} PDFs, {len(texts)} chunks")
+
+    reference = server.load_embedder("torch")
+    reference_chunks, reference_time = embed_all(reference, texts)
+    reference_queries, _ = embed_all(reference, queries)
+
+    other = server.load_embedder(candidate)
+    candidate_chunks, candidate_time = embed_all(other, texts)
+    candidate_queries, _ = embed_all(other, queries)
+
+    print(f"torch: {reference_time:.2f}s, {candidate}: {candidate_time:.2f}s "
+          f"({reference_time / candidate_time:.1f}x)")
+    print()
+
+    passed = True
+    for (persona, job), ref_query, cand_query in zip(QUERIES, reference_queries, candidate_queries):
+        ref_top = list(server.top_k_indices(reference_chunks @ ref_query, TOP_K))
+        cand_top = list(server.top_k_indices(candidate_chunks @ cand_query, TOP_K))
+
+        shared = set(ref_top) & set(cand_top)
+        overlap = len(shared) / max(len(ref_top), 1)
+        rank_shift = max((abs(ref_top.index(i) - cand_top.index(i)) for i in shared), default=0)
+        ok = overlap >= MIN_OVERLAP and rank_shift <= MAX_RANK_SHIFT
+        passed = passed and ok
+
+        status = "✅ PASS" if ok else "❌ FAIL"
+        print(f"{status}: {persona} / {job}")
+        print(f"   top-{TOP_K} overlap {overlap:.0%}, max rank shift {rank_shift}, "
+              f"first hit {'same' if ref_top[:1] == cand_top[:1] else 'different'}")
+
+    print()
+    max_drift = float(np.max(np.abs(reference_chunks - candidate_chunks))) if texts else 0.0
+    print(f"Max embedding component difference: {max_drift:.4f}")
+    return passed
+
+
+if __name__ == "__main__":
+    success = main()
+    print("\n🎉 Rankings are stable." if success else "\n⚠️  Rankings changed beyond the tolerance.")
+    sys.exit(0 if success else 1)
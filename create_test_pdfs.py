@@ -6,6 +6,7 @@ Create sample PDF files for testing the Document Intelligence application
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 import os
+import sys
 
 def create_pdf(filename, content, title):
     """Create a PDF file with the given content"""
@@ -32,7 +33,7 @@ def create_pdf(filename, content, title):
 # Create test PDFs with different content types
 test_pdfs = [
     {
-        "filename": "/app/test_pdfs/software_engineering.pdf",
+        "filename": "software_engineering.pdf",
         "title": "Software Engineering Best Practices",
         "content": """
 Software Engineering Best Practices
@@ -87,7 +88,7 @@ Performance Optimization:
         """
     },
     {
-        "filename": "/app/test_pdfs/machine_learning.pdf",
+        "filename": "machine_learning.pdf",
         "title": "Machine Learning Fundamentals",
         "content": """
 Machine Learning Fundamentals
@@ -150,7 +151,7 @@ Popular ML Libraries:
         """
     },
     {
-        "filename": "/app/test_pdfs/cooking_recipes.pdf",
+        "filename": "cooking_recipes.pdf",
         "title": "Traditional Cooking Recipes",
         "content": """
 Traditional Cooking Recipes
@@ -235,7 +236,7 @@ Baking Techniques:
         """
     },
     {
-        "filename": "/app/test_pdfs/data_science.pdf",
+        "filename": "data_science.pdf",
         "title": "Data Science Methodology",
         "content": """
 Data Science Methodology
@@ -307,7 +308,7 @@ Data Ethics:
         """
     },
     {
-        "filename": "/app/test_pdfs/biology_research.pdf",
+        "filename": "biology_research.pdf",
         "title": "Molecular Biology Research Methods",
         "content": """
 Molecular Biology Research Methods
@@ -407,9 +408,15 @@ except ImportError:
     os.system("pip install reportlab")
     from reportlab.pdfgen import canvas
 
-# Create the PDFs
-for pdf_info in test_pdfs:
-    create_pdf(pdf_info["filename"], pdf_info["content"], pdf_info["title"])
-    print(f"Created: {pdf_info['filename']}")
-
-print("All test PDFs created successfully!")
\ No newline at end of file
+if __name__ == "__main__":
+    # Usage: python create_test_pdfs.py [output_dir]
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else "/app/test_pdfs"
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Create the PDFs
+    for pdf_info in test_pdfs:
+        filename = os.path.join(output_dir, pdf_info["filename"])
+        create_pdf(filename, pdf_info["content"], pdf_info["title"])
+        print(f"Created: {filename}")
+    
+    print("All test PDFs created successfully!")
\ No newline at end of file
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The backend is a module, not a package
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
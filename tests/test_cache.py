@@ -0,0 +1,40 @@
+import server
+
+UPLOADS = [{"filename": "a.pdf", "sha256": "aa" * 32}, {"filename": "b.pdf", "sha256": "bb" * 32}]
+
+
+def key(persona="Senior Engineer", job="Review code quality", uploads=UPLOADS, top_k=5):
+    return server.result_cache_key(persona, job, uploads, top_k)
+
+
+def test_key_folds_case_and_whitespace():
+    assert key() == key(persona="  senior   ENGINEER", job="review code\tquality\n")
+    assert key() != key(persona="Junior Engineer")
+    assert key() != key(job="Review test coverage")
+
+
+def test_key_depends_on_file_contents_not_names_or_order():
+    renamed = [{**upload, "filename": f"copy-{upload['filename']}"} for upload in reversed(UPLOADS)]
+    assert key() == key(uploads=renamed)
+    assert key() != key(uploads=UPLOADS[:1])
+    assert key() != key(uploads=[UPLOADS[0], {"filename": "b.pdf", "sha256": "cc" * 32}])
+
+
+def test_key_depends_on_top_k():
+    assert key() != key(top_k=10)
+
+
+def test_key_depends_on_pipeline_settings(monkeypatch):
+    before = key()
+    monkeypatch.setattr(server, "RANKING_MODE", "rrf" if server.RANKING_MODE != "rrf" else "dense")
+    assert key() != before
+    monkeypatch.undo()
+
+    monkeypatch.setattr(server, "CHUNK_MAX_TOKENS", server.CHUNK_MAX_TOKENS + 1)
+    assert key() != before
+
+
+def test_pipeline_config_covers_chunking_params():
+    config = server.pipeline_config()
+    assert server.chunking_params().items() <= config.items()
+    assert config["model"] == server.EMBEDDING_MODEL_NAME
@@ -0,0 +1,115 @@
+import re
+
+import fitz
+import pytest
+
+import server
+
+TEXT = (
+    "Code review is a critical process. It ensures code quality and knowledge sharing! "
+    "Test-driven development helps create more reliable software. "
+    "Continuous integration streamlines the development workflow? "
+    "Small commits are easier to review. Reviewers should focus on design first."
+)
+
+
+class WordTokenizer:
+    """Stands in for the model tokenizer, with one token per word"""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False):
+        return {"offset_mapping": [[match.span() for match in re.finditer(r"\S+", text)] for text in texts]}
+
+
+@pytest.fixture
+def word_tokenizer(monkeypatch):
+    monkeypatch.setattr(server, "_tokenizer", WordTokenizer())
+
+
+def sentences(text):
+    return [text[start:end] for start, end in server.sentence_spans(text)]
+
+
+def test_sentence_spans_keep_terminators_and_drop_whitespace():
+    assert sentences("First one.  Second one!\nThird?") == ["First one.", "Second one!", "Third?"]
+    assert sentences("No terminator at the end") == ["No terminator at the end"]
+
+
+def test_chunks_are_whole_sentences_in_order():
+    chunks = server.chunk_spans(TEXT, max_length=120)
+    assert len(chunks) > 1
+
+    # Every sentence lands in exactly one chunk, in order, and offsets round-trip
+    chunked = [sentence for start, end, _ in chunks for sentence in sentences(TEXT[start:end])]
+    assert chunked == sentences(TEXT)
+    assert all(start < end for start, end, _ in chunks)
+    assert [start for start, _, _ in chunks] == sorted(start for start, _, _ in chunks)
+
+
+def test_chunks_stay_under_the_character_budget():
+    for max_length in (60, 120, 200):
+        for start, end, size in server.chunk_spans(TEXT, max_length=max_length):
+            # Sizes count one separator per sentence
+            assert size == sum(len(sentence) + 1 for sentence in sentences(TEXT[start:end]))
+            assert size < max_length or len(sentences(TEXT[start:end])) == 1
+
+
+def test_long_sentence_becomes_its_own_chunk():
+    text = "Short one. " + "word " * 40 + "end. Another short one."
+    chunks = [text[start:end] for start, end, _ in server.chunk_spans(text, max_length=50)]
+    assert chunks == sentences(text)
+
+
+def test_overlap_repeats_trailing_sentences():
+    chunks = server.chunk_spans(TEXT, max_length=150, overlap=1)
+    assert len(chunks) > 1
+    for (_, previous_end, _), (start, _, _) in zip(chunks, chunks[1:]):
+        # The next chunk starts with the last sentence of the previous one
+        last_sentence = sentences(TEXT[:previous_end])[-1]
+        assert TEXT[start:].startswith(last_sentence)
+        assert start < previous_end
+
+
+def test_overlap_never_exceeds_the_budget():
+    for start, end, size in server.chunk_spans(TEXT, max_length=90, overlap=2):
+        assert size < 90 or len(sentences(TEXT[start:end])) == 1
+
+
+def test_token_budget(word_tokenizer):
+    chunks = server.chunk_spans(TEXT, max_tokens=12)
+    assert len(chunks) > 1
+    for start, end, size in chunks:
+        assert size == len(TEXT[start:end].split())
+        assert size <= 12
+
+
+def test_long_sentence_is_split_at_token_boundaries(word_tokenizer):
+    text = " ".join(f"w{i}" for i in range(25)) + "."
+    chunks = server.chunk_spans(text, max_tokens=10)
+    assert [size for _, _, size in chunks] == [10, 10, 5]
+    assert " ".join(text[start:end] for start, end, _ in chunks) == text
+    assert text[chunks[1][0]:chunks[1][1]].split()[0] == "w10"
+
+
+def pdf_bytes(pages):
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=10)
+    return doc.tobytes()
+
+
+def test_extract_chunks_offsets_pages_and_minimum_length(monkeypatch):
+    monkeypatch.setattr(server, "EXTRACTION_MODE", "text")
+    monkeypatch.setattr(server, "CHUNK_MODE", "chars")
+    monkeypatch.setattr(server, "CHUNK_MAX_LENGTH", 120)
+    source = pdf_bytes([TEXT, "Too short.", TEXT])
+    pages = {page["page"]: page["text"] for page in server.extract_text_from_pdf(source)}
+
+    chunks = server.extract_chunks(source)
+    assert {chunk["page"] for chunk in chunks} == {1, 3}
+    for chunk in chunks:
+        assert pages[chunk["page"]][chunk["start"]:chunk["end"]] == chunk["text"]
+        assert len(chunk["text"]) >= server.MIN_CHUNK_LENGTH
+
+    # A page range yields the chunks of its pages only
+    assert server.extract_chunks(source, 2, 3) == [chunk for chunk in chunks if chunk["page"] == 3]
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+import server
+
+CHUNKS = [
+    "Code review is a critical process that ensures code quality and knowledge sharing across the team. "
+    "Reviewers should look at the design of a change before its details, ask questions instead of giving "
+    "orders, and keep their comments specific. Small changes are reviewed faster and more thoroughly, so "
+    "authors should split large features into a series of focused commits.",
+    "Test-driven development helps create more reliable and maintainable software. Developers write a "
+    "failing test first, then the simplest code that makes it pass, and finally refactor while the tests "
+    "stay green. The resulting suite documents the intended behaviour and catches regressions early, "
+    "which makes later changes to the code base much safer.",
+    "Continuous integration merges every change into the main branch several times a day. Each merge "
+    "triggers an automated build and the full test suite, so integration problems surface within minutes "
+    "instead of at the end of a release cycle. Teams that keep the build green can deploy at any time "
+    "with confidence.",
+    "Baking requires precise measurements and careful timing for every recipe. Weigh flour instead of "
+    "using cups, bring butter and eggs to room temperature, and preheat the oven well before the dough "
+    "is ready. Opening the oven door too early lets the heat escape and can make cakes collapse in the "
+    "middle.",
+]
+
+
+def edit_word(text, index, word):
+    words = text.split()
+    words[index] = word
+    return " ".join(words)
+
+
+def similarity(a, b):
+    return float(np.mean(server.minhash(a) == server.minhash(b)))
+
+
+@pytest.mark.parametrize("index", [0, 7, 20, 33, -1])
+def test_one_word_edit_is_a_near_duplicate(index):
+    for chunk in CHUNKS:
+        assert similarity(chunk, edit_word(chunk, index, "banana")) >= server.NEAR_DUPLICATE_JACCARD
+
+
+@pytest.mark.parametrize("variant", [
+    "ACME Corp Annual Report 2024 {}",
+    "{} Page 12 of 40",
+    "Confidential {} Internal use only",
+])
+def test_header_and_footer_variants_are_near_duplicates(variant):
+    for chunk in CHUNKS:
+        assert similarity(chunk, variant.format(chunk)) >= server.NEAR_DUPLICATE_JACCARD
+
+
+def test_unrelated_chunks_are_not_near_duplicates():
+    for i, chunk in enumerate(CHUNKS):
+        for other in CHUNKS[i + 1:]:
+            assert similarity(chunk, other) < 0.3
+
+
+class CountingEmbedder:
+    """Stands in for the embedding model, recording the texts it encodes"""
+
+    dim = 4
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        # Row n holds the number of the text in encoding order
+        first = len(self.encoded)
+        self.encoded.extend(texts)
+        return np.arange(first, len(self.encoded), dtype=np.float32)[:, None].repeat(self.dim, axis=1)
+
+
+def test_deduplicator_reuses_embeddings_of_near_duplicates():
+    embedder = CountingEmbedder()
+    dedup = server.ChunkDeduplicator(mode="near")
+    first = dedup.embed(CHUNKS, embedder=embedder)
+
+    variants = [edit_word(CHUNKS[0], 10, "banana"), CHUNKS[1] + " Page 3", CHUNKS[2].upper()]
+    second = dedup.embed(variants + [variants[0]], embedder=embedder)
+
+    assert embedder.encoded == CHUNKS
+    assert (second[:3] == first[:3]).all()
+    assert (second[3] == first[0]).all()
+    assert (dedup.embedded, dedup.reused) == (4, 4)
+
+
+def test_exact_mode_only_reuses_identical_text():
+    embedder = CountingEmbedder()
+    dedup = server.ChunkDeduplicator(mode="exact")
+    dedup.embed(CHUNKS + [CHUNKS[0], edit_word(CHUNKS[1], 5, "banana")], embedder=embedder)
+    assert len(embedder.encoded) == len(CHUNKS) + 1
+
+
+def test_near_repeats_of_other_sources_are_borrowed():
+    dedup = server.ChunkDeduplicator(mode="near")
+    dedup.embed(CHUNKS[:2], sources=[0, 0], embedder=CountingEmbedder())
+    assert not dedup.borrowed
+
+    # Exact repeats and near repeats within a source embed the same text alone
+    dedup.embed([CHUNKS[0], CHUNKS[2], CHUNKS[2] + " Page 3"], sources=[1, 1, 1], embedder=CountingEmbedder())
+    assert not dedup.borrowed
+
+    dedup.embed([CHUNKS[1] + " Page 3", CHUNKS[3], CHUNKS[3] + " Page 4"], sources=[2, 3, 4], embedder=CountingEmbedder())
+    assert dedup.borrowed == {2, 4}
@@ -0,0 +1,55 @@
+import base64
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    cursor = server.encode_cursor({"timestamp": timestamp, "id": "b2c4", "persona": "ignored"})
+    assert server.cursor_filter(cursor) == {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "id": {"$lt": "b2c4"}}
+    ]}
+
+
+def test_cursor_selects_entries_after_it_in_history_order():
+    entries = [
+        {"timestamp": datetime(2024, 5, day), "id": entry_id}
+        for day, entry_id in [(3, "a"), (2, "c"), (2, "b"), (2, "a"), (1, "z")]
+    ]
+    cursor = server.cursor_filter(server.encode_cursor(entries[2]))
+    earlier, same_time = cursor["$or"]
+
+    def after(entry):
+        return (entry["timestamp"] < earlier["timestamp"]["$lt"]
+                or entry["timestamp"] == same_time["timestamp"] and entry["id"] < same_time["id"]["$lt"])
+
+    assert [entry for entry in entries if after(entry)] == entries[3:]
+
+
+def test_no_cursor_selects_everything():
+    assert server.cursor_filter(None) == {}
+    assert server.cursor_filter("") == {}
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    b64(b"\xff\xfe"),
+    b64(b"{}"),
+    b64(b"5"),
+    b64(b'["2024-05-01"]'),
+    b64(b'[1, "b2c4"]'),
+    b64(b'["yesterday", "b2c4"]'),
+])
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        server.cursor_filter(cursor)
+    assert excinfo.value.status_code == 400
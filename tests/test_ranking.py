@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import server
+
+TEXTS = ["Apple banana apple", "banana cherry", "cherry date elderberry fig"]
+
+
+def test_bm25_matches_hand_computed_scores():
+    # N = 3 texts of 3, 2 and 4 terms, so avgdl = 3; k1 = 1.2, b = 0.75, and
+    # idf = ln(1 + (N - df + 0.5) / (df + 0.5))
+    scores = server.BM25Index(TEXTS, k1=1.2, b=0.75).scores(["apple", "banana cherry"])
+
+    # "apple": df 1, idf ln(8/3); tf 2 in text 0 of average length:
+    # idf * 2 * 2.2 / (2 + 1.2)
+    assert scores[0] == pytest.approx([1.3486402, 0.0, 0.0], rel=1e-5)
+
+    # "banana" and "cherry": df 2, idf ln(1.6); text 1 has both once and
+    # 2 terms, so each contributes idf * 2.2 / (1 + 1.2 * (0.25 + 0.75 * 2 / 3));
+    # texts 0 and 2 have one of them once at lengths 3 and 4
+    idf = np.log(1.6)
+    assert scores[1] == pytest.approx([
+        idf * 2.2 / (1 + 1.2),
+        2 * idf * 2.2 / (1 + 0.9),
+        idf * 2.2 / (1 + 1.2 * (0.25 + 0.75 * 4 / 3))
+    ], rel=1e-5)
+
+
+def test_bm25_ignores_case_and_unknown_terms():
+    scores = server.bm25_scores(TEXTS, ["APPLE", "kiwi", ""])
+    assert scores.shape == (3, 3)
+    assert scores[0, 0] > 0
+    assert not scores[1:].any()
+
+
+def test_bm25_of_no_texts():
+    assert server.bm25_scores([], ["apple"]).shape == (1, 0)
+
+
+def test_reciprocal_ranks():
+    ranks = server.reciprocal_ranks(np.array([0.2, 0.9, 0.5]))
+    assert ranks == pytest.approx([1 / (server.RRF_K + 3), 1 / (server.RRF_K + 1), 1 / (server.RRF_K + 2)])
+
+
+def test_rrf_fusion_skips_texts_without_query_terms():
+    dense = np.array([0.9, 0.5, 0.1])
+    lexical = np.array([0.0, 2.0, 1.0])
+    fused = server.fuse_scores(dense, lexical, mode="rrf")
+    k = server.RRF_K
+    assert fused == pytest.approx([1 / (k + 1), 1 / (k + 2) + 1 / (k + 1), 1 / (k + 3) + 1 / (k + 2)])
+    assert list(np.argsort(-fused)) == [1, 2, 0]
+
+
+def test_weighted_fusion_blends_normalized_scores(monkeypatch):
+    monkeypatch.setattr(server, "FUSION_WEIGHT", 0.7)
+    dense = np.array([0.9, 0.5, 0.1])
+    lexical = np.array([0.0, 4.0, 2.0])
+    fused = server.fuse_scores(dense, lexical, mode="weighted")
+    assert fused == pytest.approx([0.7, 0.7 * 0.5 + 0.3, 0.3 * 0.5])
+
+
+def test_fusion_works_per_query_row():
+    dense = np.array([[0.9, 0.5, 0.1], [0.1, 0.5, 0.9]])
+    lexical = server.bm25_scores(TEXTS, ["apple", "fig"])
+    fused = server.fuse_scores(dense, lexical, mode="rrf")
+    for row in range(2):
+        assert fused[row] == pytest.approx(server.fuse_scores(dense[row], lexical[row], mode="rrf"))
+
+
+def unit_rows(*rows):
+    embeddings = np.array(rows, dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def test_mmr_without_diversity_is_ranking_by_relevance():
+    relevance = np.array([0.3, 0.9, 0.5, 0.7])
+    embeddings = unit_rows([1, 0], [1, 0.01], [0, 1], [1, 1])
+    assert server.mmr_select(embeddings, relevance, 3, 1.0) == list(server.top_k_indices(relevance, 3))
+
+
+def test_mmr_skips_near_duplicates():
+    # Rows 0 and 1 are nearly the same text; row 2 is less relevant but new
+    embeddings = unit_rows([1, 0], [1, 0.01], [0, 1])
+    relevance = np.array([0.9, 0.89, 0.5])
+    assert server.mmr_select(embeddings, relevance, 2, 0.5) == [0, 2]
+    assert server.mmr_select(embeddings, relevance, 3, 0.5) == [0, 2, 1]
+
+
+def test_mmr_caps_rows_per_group():
+    embeddings = unit_rows([1, 0], [1, 0.1], [1, 0.2], [0, 1])
+    relevance = np.array([0.9, 0.8, 0.7, 0.1])
+    groups = np.array([0, 0, 0, 1])
+    assert server.mmr_select(embeddings, relevance, 4, 1.0, groups, max_per_group=2) == [0, 1, 3]
+    assert server.mmr_select(embeddings, relevance, 4, 1.0, groups, max_per_group=1) == [0, 3]
+    assert server.mmr_select(embeddings, relevance, 4, 1.0, groups) == [0, 1, 2, 3]
+
+
+def test_mmr_returns_at_most_the_available_rows():
+    embeddings = unit_rows([1, 0], [0, 1])
+    assert server.mmr_select(embeddings, np.array([0.5, 0.4]), 5, 0.7) == [0, 1]
+    assert server.mmr_select(embeddings[:0], np.zeros(0), 5, 0.7) == []
@@ -0,0 +1,89 @@
+import fitz
+
+import server
+
+BODY = [
+    "Code review is a critical process that ensures code quality.",
+    "It also spreads knowledge of the code base across the team.",
+    "Reviews work best when changes are small and focused.",
+]
+
+
+def layout_pdf(pages):
+    """PDF bytes of pages given as lists of (text, size, bold) lines"""
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page()
+        y = 60
+        for text, size, bold in lines:
+            page.insert_text((50, y), text, fontsize=size, fontname="hebo" if bold else "helv")
+            y += size * 2
+    return doc.tobytes()
+
+
+def body(lines):
+    return [(line, 10, False) for line in lines]
+
+
+def test_finish_section_maps_offsets_to_pages():
+    section = {
+        "title": "Reviews",
+        "page": 1,
+        "page_end": 3,
+        "parts": [(1, "first"), (1, "second"), (2, "third"), (3, "fourth")]
+    }
+    finished = server.finish_section(section)
+    assert finished["text"] == "first second third fourth"
+    assert finished["page_starts"] == [(0, 1), (13, 2), (19, 3)]
+    for offset, page in finished["page_starts"]:
+        first_part = next(text for part_page, text in section["parts"] if part_page == page)
+        assert finished["text"][offset:].startswith(first_part)
+
+
+def test_is_heading():
+    assert server.is_heading("Introduction", 14, False, 10)
+    assert server.is_heading("Introduction", 10, True, 10)
+    assert not server.is_heading("Introduction", 10, False, 10)
+    assert not server.is_heading("A full sentence in a large font.", 14, False, 10)
+    assert not server.is_heading("12.3", 14, False, 10)
+
+
+def test_sections_split_at_headings_and_span_pages():
+    source = layout_pdf([
+        body(BODY[:1]) + [("Code Review", 16, True)] + body(BODY[1:]),
+        body(BODY) + [("Testing", 16, True)] + body(BODY[:2]),
+    ])
+    sections = list(server.extract_sections(source))
+
+    assert [section["title"] for section in sections] == [None, "Code Review", "Testing"]
+    assert [(section["page"], section["page_end"]) for section in sections] == [(1, 1), (1, 2), (2, 2)]
+
+    # The second section continues on page 2 exactly where page 2's lines start
+    review = sections[1]
+    assert review["page_starts"] == [(0, 1), (len(" ".join(BODY[1:])) + 1, 2)]
+    assert review["text"] == " ".join(BODY[1:] + BODY)
+
+
+def test_sections_never_span_page_ranges():
+    source = layout_pdf([
+        [("Code Review", 16, True)] + body(BODY),
+        body(BODY),
+    ])
+    assert [(section["title"], section["page"]) for section in server.extract_sections(source, 1, 2)] == [(None, 2)]
+
+
+def test_layout_chunks_carry_titles_and_page_spans(monkeypatch):
+    monkeypatch.setattr(server, "EXTRACTION_MODE", "layout")
+    monkeypatch.setattr(server, "CHUNK_MODE", "chars")
+    monkeypatch.setattr(server, "CHUNK_MAX_LENGTH", 150)
+    source = layout_pdf([
+        [("Code Review", 16, True)] + body(BODY),
+        body(BODY),
+    ])
+    sections = {section["title"]: section for section in server.extract_sections(source)}
+
+    chunks = server.extract_chunks(source)
+    assert {chunk["title"] for chunk in chunks} == {"Code Review"}
+    assert [(chunk["page"], chunk["page_end"]) for chunk in chunks] == [(1, 1), (1, 2), (2, 2)]
+    for chunk in chunks:
+        assert sections[chunk["title"]]["text"][chunk["start"]:chunk["end"]] == chunk["text"]